@@ -0,0 +1,152 @@
+"""
+Benchmark the streaming timetable parsers against the former ElementTree
+implementation on synthetic multi-megabyte plan and fchg responses.
+
+Run from the repository root:
+    python -m benchmarks.bench_parsers [number_of_stops]
+"""
+import random
+import sys
+import time
+import tracemalloc
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta
+
+from ingestion.utils import (
+    iter_planned_timetable,
+    iter_recent_changes,
+    parse_db_time,
+    parse_planned_timetable,
+    parse_recent_changes,
+)
+
+# -----------------------------
+# Former implementation (ET.fromstring + uncached strptime)
+# -----------------------------
+def legacy_parse_db_time(ts):
+    return datetime.strptime(ts, "%y%m%d%H%M") if ts else None
+
+def legacy_parse_planned_timetable(response):
+    root = ET.fromstring(response)
+    stops = {}
+    for stop in root.findall("s"):
+        trip_label = stop.find("tl")
+        ar = stop.find("ar")
+        dp = stop.find("dp")
+        stops[stop.attrib.get("id")] = {
+            "train_category": trip_label.attrib.get("c") if trip_label is not None else None,
+            "train_number": trip_label.attrib.get("n") if trip_label is not None else None,
+            "train_operator": trip_label.attrib.get("o") if trip_label is not None else None,
+            "platform": ar.attrib.get("pp") if ar is not None else None,
+            "route_before_arrival": ar.attrib.get("ppth") if ar is not None else None,
+            "planned_arrival_time": legacy_parse_db_time(ar.attrib.get("pt")) if ar is not None else None,
+            "route_after_departure": dp.attrib.get("ppth") if dp is not None else None,
+            "planned_departure_time": legacy_parse_db_time(dp.attrib.get("pt")) if dp is not None else None,
+        }
+    return stops
+
+def legacy_parse_recent_changes(response):
+    root = ET.fromstring(response)
+    stops = {}
+    for stop in root.findall("s"):
+        ar = stop.find("ar")
+        dp = stop.find("dp")
+        stops[stop.attrib.get("id")] = {
+            "actual_arrival_time": legacy_parse_db_time(ar.attrib.get("ct")) if ar is not None else None,
+            "actual_departure_time": legacy_parse_db_time(dp.attrib.get("ct")) if dp is not None else None,
+        }
+    return stops
+
+# -----------------------------
+# Synthetic responses
+# -----------------------------
+ROUTE = "|".join(f"Station {i}" for i in range(12))
+MESSAGE = '<m id="r{0}" t="d" c="{1}" ts="{2}"/>'
+
+def db_time(dt):
+    return dt.strftime("%y%m%d%H%M")
+
+def synthetic_plan(stops, seed=1):
+    rng = random.Random(seed)
+    start = datetime(2025, 11, 12, 0, 0)
+    parts = ["<?xml version='1.0' encoding='UTF-8'?>", '<timetable station="Hamburg Hbf">']
+    for i in range(stops):
+        arrival = start + timedelta(minutes=rng.randrange(0, 24 * 60))
+        departure = arrival + timedelta(minutes=rng.randrange(1, 5))
+        parts.append(
+            f'<s id="{rng.getrandbits(63)}-{db_time(arrival)}-{i}">'
+            f'<tl f="F" t="p" o="80" c="ICE" n="{i}"/>'
+            f'<ar pt="{db_time(arrival)}" pp="{i % 14}" ppth="{ROUTE}"/>'
+            f'<dp pt="{db_time(departure)}" pp="{i % 14}" ppth="{ROUTE}"/>'
+            "</s>"
+        )
+    parts.append("</timetable>")
+    return "".join(parts).encode("utf-8")
+
+def synthetic_changes(stops, seed=2):
+    rng = random.Random(seed)
+    start = datetime(2025, 11, 12, 0, 0)
+    parts = ["<?xml version='1.0' encoding='UTF-8'?>", '<timetable station="Hamburg Hbf" eva="8002549">']
+    for i in range(stops):
+        arrival = start + timedelta(minutes=rng.randrange(0, 24 * 60))
+        departure = arrival + timedelta(minutes=rng.randrange(1, 5))
+        messages = "".join(MESSAGE.format(j, rng.randrange(100), db_time(arrival)) for j in range(3))
+        parts.append(
+            f'<s id="{rng.getrandbits(63)}-{db_time(arrival)}-{i}" eva="8002549">'
+            f"{messages}"
+            f'<ar ct="{db_time(arrival)}" l="1">{messages}</ar>'
+            f'<dp ct="{db_time(departure)}" l="1">{messages}</dp>'
+            "</s>"
+        )
+    parts.append("</timetable>")
+    return "".join(parts).encode("utf-8")
+
+# -----------------------------
+# Measurement
+# -----------------------------
+def consume(iterator):
+    deque(iterator, maxlen=0)
+
+def measure(func, payload):
+    # Time and memory are measured in separate runs since tracing slows parsing down
+    parse_db_time.cache_clear()
+    started = time.perf_counter()
+    func(payload)
+    elapsed = time.perf_counter() - started
+
+    parse_db_time.cache_clear()
+    tracemalloc.start()
+    func(payload)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+def run(name, payload, candidates):
+    print(f"\n{name}: {len(payload) / 1e6:.1f} MB")
+    print(f"{'parser':<36}{'time (s)':>10}{'peak (MB)':>12}")
+    for label, func in candidates:
+        elapsed, peak = measure(func, payload)
+        print(f"{label:<36}{elapsed:>10.3f}{peak / 1e6:>12.1f}")
+
+def main():
+    stops = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    plan = synthetic_plan(stops)
+    assert parse_planned_timetable(plan) == legacy_parse_planned_timetable(plan)
+    run("plan", plan, [
+        ("legacy parse_planned_timetable", legacy_parse_planned_timetable),
+        ("parse_planned_timetable", parse_planned_timetable),
+        ("iter_planned_timetable (streamed)", lambda p: consume(iter_planned_timetable(p))),
+    ])
+
+    changes = synthetic_changes(stops)
+    assert parse_recent_changes(changes) == legacy_parse_recent_changes(changes)
+    run("fchg", changes, [
+        ("legacy parse_recent_changes", legacy_parse_recent_changes),
+        ("parse_recent_changes", parse_recent_changes),
+        ("iter_recent_changes (streamed)", lambda p: consume(iter_recent_changes(p))),
+    ])
+
+if __name__ == "__main__":
+    main()
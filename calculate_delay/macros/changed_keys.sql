@@ -0,0 +1,23 @@
+{#
+    Condition selecting the rows of a relation whose updated_at is newer than the
+    watermark of the model being built (max updated_at in {{ this }}).
+    A small lookback re-processes rows written by transactions still open during
+    the previous run; re-processing is idempotent with delete+insert.
+#}
+{% macro updated_since_watermark(column='updated_at') %}
+    {{ column }} > (
+        select coalesce(max(updated_at), '-infinity'::timestamptz) - interval '{{ var("incremental_lookback", "10 minutes") }}'
+        from {{ this }}
+    )
+{% endmacro %}
+
+{#
+    Array of the distinct `key` values of `relation` rows changed since the watermark.
+#}
+{% macro changed_keys(relation, key) %}
+    array(
+        select distinct {{ key }}
+        from {{ relation }}
+        where {{ updated_since_watermark() }}
+    )
+{% endmacro %}
@@ -0,0 +1,23 @@
+{#
+    Refuse a full refresh while raw_timetable partitions are archived: the rebuilt
+    models would silently lose the history of the dropped days. Restore them first
+    with `python -m ingestion.partitions --restore <day>`, or pass
+    `--vars '{allow_partial_history: true}'` to rebuild from what is left.
+#}
+{% macro guard_full_refresh() %}
+    {% if execute and flags.FULL_REFRESH and not var('allow_partial_history', false) %}
+        {% set archived = adapter.get_relation(database=target.database, schema=target.schema, identifier='archived_partitions') %}
+        {% if archived is not none %}
+            {% set result = run_query("select count(*), min(day), max(day) from " ~ archived) %}
+            {% set row = result.rows[0] %}
+            {% if row[0] > 0 %}
+                {{ exceptions.raise_compiler_error(
+                    "Full refresh refused: " ~ row[0] ~ " raw_timetable partitions from " ~ row[1] ~ " to " ~ row[2]
+                    ~ " are archived (see archived_partitions). Restore them with"
+                    ~ " `python -m ingestion.partitions --restore <day>`, or pass"
+                    ~ " --vars '{allow_partial_history: true}' to rebuild without them."
+                ) }}
+            {% endif %}
+        {% endif %}
+    {% endif %}
+{% endmacro %}
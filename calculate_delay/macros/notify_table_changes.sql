@@ -0,0 +1,34 @@
+{#
+    Remember the watermark (max updated_at) of the model before it is built, in a
+    transaction-local setting read back by notify_table_changes(). Runs as a
+    pre-hook, in the same transaction as the model and its post-hooks. A full
+    refresh, or a table built before models had updated_at, has no watermark.
+#}
+{% macro record_watermark() %}
+    {% set relation = adapter.get_relation(database=this.database, schema=this.schema, identifier=this.identifier) if execute %}
+    {% set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | map('lower') | list
+        if relation is not none else [] %}
+    {% if model.config.materialized == 'view' %}
+        {# views have no watermark and are never announced #}
+    {% elif not flags.FULL_REFRESH and relation is not none and relation.is_table and 'updated_at' in columns %}
+        select set_config('calculate_delay.watermark', coalesce(max(updated_at), '-infinity')::text, true)
+        from {{ this }}
+    {% else %}
+        select set_config('calculate_delay.watermark', '-infinity', true)
+    {% endif %}
+{% endmacro %}
+
+{#
+    Announce a model on the table_changes channel, like the ingestion loaders do for
+    raw_timetable, when the run wrote rows newer than its previous watermark (or on
+    a full refresh). Runs as a post-hook, so the notification is delivered when the
+    model's transaction commits; runs that only re-processed the lookback stay quiet.
+#}
+{% macro notify_table_changes() %}
+    {% if model.config.materialized != 'view' %}
+        select pg_notify('table_changes', '{{ this.identifier }}')
+        where {{ 'true' if flags.FULL_REFRESH else 'false' }}
+           or (select max(updated_at) from {{ this }})
+              > current_setting('calculate_delay.watermark')::timestamptz
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,25 @@
+{#
+    Drop the tables of selected incremental models that have no updated_at column,
+    i.e. were built by the former table materializations. Their watermark cannot be
+    read and their columns do not match the model, so the run rebuilds them in full
+    instead of failing. Runs on-run-start; a no-op once every model was rebuilt.
+#}
+{% macro rebuild_outdated_models() %}
+    {% if execute and not flags.FULL_REFRESH %}
+        {% for node in graph.nodes.values()
+            if node.resource_type == 'model'
+            and node.package_name == project_name
+            and node.config.materialized == 'incremental'
+            and node.unique_id in selected_resources %}
+            {% set relation = adapter.get_relation(database=node.database, schema=node.schema, identifier=node.alias) %}
+            {% if relation is not none and relation.is_table %}
+                {% set columns = adapter.get_columns_in_relation(relation) | map(attribute='name') | map('lower') | list %}
+                {% if 'updated_at' not in columns %}
+                    {{ log("Dropping " ~ relation ~ ": it has no updated_at column and is rebuilt in full", info=True) }}
+                    {% do adapter.drop_relation(relation) %}
+                    {% do adapter.commit() %}
+                {% endif %}
+            {% endif %}
+        {% endfor %}
+    {% endif %}
+{% endmacro %}
@@ -0,0 +1,44 @@
+{{ config(
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='planned_date'
+) }}
+
+-- Delay rollup at the (planned_date, hour, station, category, operator) grain.
+-- Sums, counts and maxima merge into any coarser grain, so every mart is built
+-- from this table instead of scanning stg_timetables again. Only planned dates
+-- with rows changed since the last run are recomputed.
+with stg as (
+    select
+        s.planned_date,
+        extract(hour from coalesce(s.planned_arrival_time, s.planned_departure_time))::int as hour,
+        coalesce(si.name, 'Unknown') as station_name,
+        coalesce(s.train_category, 'Unknown') as train_category,
+        coalesce(s.train_operator, 'Unknown') as train_operator,
+        coalesce(s.arrival_delay_seconds, 0) / 60.0 as arrival_delay_min,
+        coalesce(s.departure_delay_seconds, 0) / 60.0 as departure_delay_min,
+        s.updated_at
+    from {{ ref('stg_timetables') }} s
+    left join {{ source('raw', 'raw_stations') }} si
+        on cast(s.eva_number as bigint) = si.eva_number
+    {% if is_incremental() %}
+    where s.planned_date = any({{ changed_keys(source('raw', 'raw_timetable'), 'planned_date') }})
+    {% endif %}
+)
+
+select
+    planned_date,
+    hour,
+    station_name,
+    train_category,
+    train_operator,
+    count(*) as stop_count,
+    coalesce(sum(arrival_delay_min), 0) as arrival_delay_sum_min,
+    coalesce(sum(departure_delay_min), 0) as departure_delay_sum_min,
+    count(arrival_delay_min) as arrival_delay_count,
+    count(departure_delay_min) as departure_delay_count,
+    max(arrival_delay_min) as arrival_delay_max_min,
+    max(departure_delay_min) as departure_delay_max_min,
+    max(updated_at) as updated_at
+from stg
+group by planned_date, hour, station_name, train_category, train_operator
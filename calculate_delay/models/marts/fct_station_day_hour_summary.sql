@@ -1,41 +1,59 @@
 {{ config(
     materialized='incremental',
-    unique_key=['date', 'hour', 'station_name']
+    incremental_strategy='delete+insert',
+    unique_key=['date', 'hour', 'station_name'],
+    indexes=[
+        {'columns': ['station_name', 'date']}
+    ]
 ) }}
 
-with base as (
+-- Sums and counts per (date, hour, station), merged from int_delay_rollup. A run
+-- recomputes every bucket that holds a row changed since the last run, including
+-- delays that update_timetables applied to stops already aggregated, so no full
+-- refresh is needed.
+with rollup as (
     select
+        planned_date as date,
+        hour,
         station_name,
-        coalesce(planned_arrival_time, planned_departure_time) as reference_time,
-        arrival_delay,
-        departure_delay
-    from {{ ref('int_station_delay') }}
+        arrival_delay_sum_min,
+        departure_delay_sum_min,
+        arrival_delay_count,
+        departure_delay_count,
+        arrival_delay_max_min,
+        departure_delay_max_min,
+        updated_at
+    from {{ ref('int_delay_rollup') }}
     {% if is_incremental() %}
-        where coalesce(planned_arrival_time, planned_departure_time) > 
-              (select max(reference_time) from {{ this }})
+        where planned_date = any({{ changed_keys(ref('int_delay_rollup'), 'planned_date') }})
     {% endif %}
 ),
 
-transformed as (
-    select
-        station_name,
-        cast(date_trunc('day', reference_time) as date) as date,
-        extract(hour from reference_time) as hour,
-        extract(epoch from arrival_delay::interval)/60.0 as arrival_delay_min,
-        extract(epoch from departure_delay::interval)/60.0 as departure_delay_min,
-        reference_time
-    from base
+{% if is_incremental() %}
+changed_buckets as (
+    select distinct date, hour, station_name
+    from rollup
+    where {{ updated_since_watermark() }}
 ),
+{% endif %}
 
 aggregated as (
     select
-        date,
-        hour,
-        station_name,
-        avg(arrival_delay_min) as avg_arrival_delay_min,
-        avg(departure_delay_min) as avg_departure_delay_min,
-        max(reference_time) as reference_time
-    from transformed
+        r.date,
+        r.hour,
+        r.station_name,
+        sum(r.arrival_delay_sum_min) as arrival_delay_sum_min,
+        sum(r.departure_delay_sum_min) as departure_delay_sum_min,
+        sum(r.arrival_delay_count) as arrival_delay_count,
+        sum(r.departure_delay_count) as departure_delay_count,
+        max(r.arrival_delay_max_min) as max_arrival_delay_min,
+        max(r.departure_delay_max_min) as max_departure_delay_min,
+        max(r.updated_at) as updated_at
+    from rollup r
+    {% if is_incremental() %}
+    join changed_buckets b
+        on r.date = b.date and r.hour = b.hour and r.station_name = b.station_name
+    {% endif %}
     group by 1,2,3
 )
 
@@ -43,8 +61,14 @@ select
     date,
     hour,
     station_name,
-    avg_arrival_delay_min,
-    avg_departure_delay_min,
-    reference_time
+    arrival_delay_sum_min / nullif(arrival_delay_count, 0) as avg_arrival_delay_min,
+    departure_delay_sum_min / nullif(departure_delay_count, 0) as avg_departure_delay_min,
+    arrival_delay_sum_min,
+    departure_delay_sum_min,
+    arrival_delay_count,
+    departure_delay_count,
+    max_arrival_delay_min,
+    max_departure_delay_min,
+    updated_at
 from aggregated
 order by date, hour, station_name
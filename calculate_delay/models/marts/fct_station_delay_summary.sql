@@ -1,13 +1,39 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='station_name',
     tags=['mart']
 ) }}
 
+WITH stations AS (
+    SELECT
+        station_name,
+        SUM(arrival_delay_sum_min) AS arrival_delay_sum_min,
+        SUM(departure_delay_sum_min) AS departure_delay_sum_min,
+        SUM(arrival_delay_count) AS arrival_delay_count,
+        SUM(departure_delay_count) AS departure_delay_count,
+        SUM(stop_count) AS total_delays,
+        MAX(arrival_delay_max_min) AS max_arrival_delay_min,
+        MAX(departure_delay_max_min) AS max_departure_delay_min,
+        MAX(updated_at) AS updated_at
+    FROM {{ ref('int_delay_rollup') }}
+    {% if is_incremental() %}
+    WHERE station_name = ANY({{ changed_keys(ref('int_delay_rollup'), 'station_name') }})
+    {% endif %}
+    GROUP BY station_name
+)
+
 SELECT
     station_name,
-    ROUND(AVG(EXTRACT(EPOCH FROM arrival_delay) / 60.0), 2) AS avg_arrival_delay_min,
-    ROUND(AVG(EXTRACT(EPOCH FROM departure_delay) / 60.0), 2) AS avg_departure_delay_min,
-    COUNT(*) AS total_delays
-FROM {{ ref('int_station_delay') }}
-GROUP BY station_name
+    ROUND(arrival_delay_sum_min / NULLIF(arrival_delay_count, 0), 2) AS avg_arrival_delay_min,
+    ROUND(departure_delay_sum_min / NULLIF(departure_delay_count, 0), 2) AS avg_departure_delay_min,
+    total_delays,
+    arrival_delay_sum_min,
+    departure_delay_sum_min,
+    arrival_delay_count,
+    departure_delay_count,
+    max_arrival_delay_min,
+    max_departure_delay_min,
+    updated_at
+FROM stations
 ORDER BY station_name
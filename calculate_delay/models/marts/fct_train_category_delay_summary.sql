@@ -1,12 +1,39 @@
 {{ config(
-    materialized='table',
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='train_category',
     tags=['mart']
 ) }}
 
+WITH categories AS (
+    SELECT
+        train_category,
+        SUM(arrival_delay_sum_min) AS arrival_delay_sum_min,
+        SUM(departure_delay_sum_min) AS departure_delay_sum_min,
+        SUM(arrival_delay_count) AS arrival_delay_count,
+        SUM(departure_delay_count) AS departure_delay_count,
+        SUM(stop_count) AS total_delays,
+        MAX(arrival_delay_max_min) AS max_arrival_delay_min,
+        MAX(departure_delay_max_min) AS max_departure_delay_min,
+        MAX(updated_at) AS updated_at
+    FROM {{ ref('int_delay_rollup') }}
+    {% if is_incremental() %}
+    WHERE train_category = ANY({{ changed_keys(ref('int_delay_rollup'), 'train_category') }})
+    {% endif %}
+    GROUP BY train_category
+)
+
 SELECT
     train_category,
-    avg_arrival_delay_min,
-    avg_departure_delay_min,
-    total_delays
-FROM {{ ref('int_train_category_delay') }}
+    ROUND(arrival_delay_sum_min / NULLIF(arrival_delay_count, 0), 2) AS avg_arrival_delay_min,
+    ROUND(departure_delay_sum_min / NULLIF(departure_delay_count, 0), 2) AS avg_departure_delay_min,
+    total_delays,
+    arrival_delay_sum_min,
+    departure_delay_sum_min,
+    arrival_delay_count,
+    departure_delay_count,
+    max_arrival_delay_min,
+    max_departure_delay_min,
+    updated_at
+FROM categories
 ORDER BY total_delays DESC
@@ -1,13 +1,37 @@
 {{ config(
-    materialized='table'
+    materialized='incremental',
+    incremental_strategy='delete+insert',
+    unique_key='hour_of_day'
 ) }}
 
+with hourly as (
+    select
+        hour as hour_of_day,
+        sum(arrival_delay_count) as arrival_delay_count,
+        sum(departure_delay_count) as departure_delay_count,
+        sum(arrival_delay_sum_min) as arrival_delay_sum_min,
+        sum(departure_delay_sum_min) as departure_delay_sum_min,
+        max(arrival_delay_max_min) as max_arrival_delay_min,
+        max(departure_delay_max_min) as max_departure_delay_min,
+        max(updated_at) as updated_at
+    from {{ ref('int_delay_rollup') }}
+    {% if is_incremental() %}
+    where hour = any({{ changed_keys(ref('int_delay_rollup'), 'hour') }})
+    {% endif %}
+    group by hour
+)
+
 select
     hour_of_day,
     arrival_delay_count,
     departure_delay_count,
-    avg_arrival_delay_min,
-    avg_departure_delay_min,
-    (arrival_delay_count + departure_delay_count) as total_delays
-from {{ ref('int_hourly_delay_count') }}
+    round(arrival_delay_sum_min / nullif(arrival_delay_count, 0), 2) as avg_arrival_delay_min,
+    round(departure_delay_sum_min / nullif(departure_delay_count, 0), 2) as avg_departure_delay_min,
+    (arrival_delay_count + departure_delay_count) as total_delays,
+    arrival_delay_sum_min,
+    departure_delay_sum_min,
+    max_arrival_delay_min,
+    max_departure_delay_min,
+    updated_at
+from hourly
 order by hour_of_day
@@ -2,19 +2,13 @@
     materialized='view'
 ) }}
 
--- stg_timetables: compute delay and copy all raw columns
+-- stg_timetables: expose the delays stored on raw_timetable and copy all raw columns.
+-- The filter matches the partial index raw_timetable_delayed_idx, so only stops
+-- with an actual time are read.
 select
     *,
-    case 
-        when actual_arrival_time is not null and planned_arrival_time is not null 
-        then actual_arrival_time - planned_arrival_time
-        else interval '0 seconds'
-    end as arrival_delay,
-    case 
-        when actual_departure_time is not null and planned_departure_time is not null
-        then actual_departure_time - planned_departure_time
-        else interval '0 seconds'
-    end as departure_delay
+    coalesce(arrival_delay_seconds, 0) * interval '1 second' as arrival_delay,
+    coalesce(departure_delay_seconds, 0) * interval '1 second' as departure_delay
 from {{ source('raw', 'raw_timetable') }}
-where (actual_arrival_time is not null and planned_arrival_time is not null)
-   or (actual_departure_time is not null and planned_departure_time is not null)
\ No newline at end of file
+where arrival_delay_seconds is not null
+   or departure_delay_seconds is not null
@@ -0,0 +1,169 @@
+import os
+
+import pandas as pd
+from psycopg import sql
+from psycopg_pool import ConnectionPool
+
+# Connections kept open by each dashboard process
+DASHBOARD_POOL_SIZE = int(os.getenv('DASHBOARD_POOL_SIZE', '4'))
+
+# Longest date span shown hourly by the station analysis; longer spans are loaded per day
+STATION_RANGE_MAX_HOURLY_DAYS = int(os.getenv('STATION_RANGE_MAX_HOURLY_DAYS', '14'))
+
+# Columns the dashboard reads from each mart table and the dtype they are loaded as.
+# Numeric averages are cast to float8 in SQL so they arrive as floats, not Decimals.
+MART_COLUMNS = {
+    "fct_train_delay_summary": {
+        "hour_of_day": "int16",
+        "avg_arrival_delay_min": "float64",
+        "avg_departure_delay_min": "float64",
+        "total_delays": "int64",
+        "arrival_delay_count": "int64",
+        "departure_delay_count": "int64",
+    },
+    "fct_station_delay_summary": {
+        "station_name": "string",
+        "avg_arrival_delay_min": "float64",
+        "avg_departure_delay_min": "float64",
+        "total_delays": "int64",
+    },
+    "fct_train_category_delay_summary": {
+        "train_category": "string",
+        "avg_arrival_delay_min": "float64",
+        "avg_departure_delay_min": "float64",
+        "total_delays": "int64",
+    },
+}
+
+# Columns identifying a row of each mart table
+MART_KEYS = {
+    "fct_train_delay_summary": ["hour_of_day"],
+    "fct_station_delay_summary": ["station_name"],
+    "fct_train_category_delay_summary": ["train_category"],
+}
+
+# Row order of each mart table as shown by the dashboard: [(column, ascending)]
+MART_ORDER = {
+    "fct_train_delay_summary": [("hour_of_day", True)],
+    "fct_station_delay_summary": [("station_name", True)],
+    "fct_train_category_delay_summary": [("total_delays", False), ("train_category", True)],
+}
+
+STATION_DAY_HOUR_COLUMNS = {
+    "date": "datetime64[ns]",
+    "hour": "int16",
+    "station_name": "string",
+    "avg_arrival_delay_min": "float64",
+    "avg_departure_delay_min": "float64",
+}
+
+# Daily rows of fct_station_day_hour_summary, used for long date spans
+STATION_DAY_COLUMNS = {
+    "date": "datetime64[ns]",
+    "station_name": "string",
+    "avg_arrival_delay_min": "float64",
+    "avg_departure_delay_min": "float64",
+}
+
+SQL_TYPES = {
+    "int16": "int2",
+    "int64": "int8",
+    "float64": "float8",
+}
+
+def create_pool(conn_string, size=DASHBOARD_POOL_SIZE):
+    """
+    Open a connection pool shared by all dashboard queries. Connections are checked
+    before use since Neon closes idle connections when its compute suspends.
+    """
+    return ConnectionPool(
+        conn_string,
+        min_size=1,
+        max_size=size,
+        check=ConnectionPool.check_connection,
+        open=True,
+    )
+
+def projection(columns):
+    """
+    SELECT list for the given {column: dtype}, casting numbers to the loaded type.
+    """
+    return sql.SQL(", ").join(
+        sql.SQL("{}::{} AS {}").format(sql.Identifier(name), sql.SQL(SQL_TYPES[dtype]), sql.Identifier(name))
+        if dtype in SQL_TYPES else sql.Identifier(name)
+        for name, dtype in columns.items()
+    )
+
+def fetch_frame(pool, query, columns, params=None):
+    """
+    Run a query and build a DataFrame column by column with the given dtypes.
+    """
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(columns)
+    return pd.DataFrame({
+        name: pd.Series(column, dtype=dtype)
+        for (name, dtype), column in zip(columns.items(), values)
+    })
+
+def load_table(pool, table_name, columns, since=None, order=None):
+    """
+    Load the projected columns of a mart table, ordered by `order` ([(column,
+    ascending)]) or by its first column. With `since`, only rows whose updated_at
+    is newer are returned.
+    """
+    order_by = sql.SQL(", ").join(
+        sql.SQL("{} {}").format(sql.Identifier(name), sql.SQL("ASC" if ascending else "DESC"))
+        for name, ascending in order
+    ) if order else sql.SQL("1")
+    query = sql.SQL("SELECT {} FROM {} {} ORDER BY {}").format(
+        projection(columns),
+        sql.Identifier(table_name),
+        sql.SQL("WHERE updated_at > %s") if since is not None else sql.SQL(""),
+        order_by,
+    )
+    return fetch_frame(pool, query, columns, (since,) if since is not None else None)
+
+def table_version(pool, table_name):
+    """
+    Return (row count, max updated_at) of a mart table.
+    """
+    with pool.connection() as conn:
+        return conn.execute(
+            sql.SQL("SELECT count(*), max(updated_at) FROM {}").format(sql.Identifier(table_name))
+        ).fetchone()
+
+def load_station_range(pool, start_date, end_date, stations, max_hourly_days=STATION_RANGE_MAX_HOURLY_DAYS):
+    """
+    Delays of several stations between two dates (inclusive) from
+    fct_station_day_hour_summary in one query. Spans longer than `max_hourly_days`
+    are downsampled to one row per day and station in the database, weighting the
+    hourly averages by their counts, so the result never exceeds a few thousand rows.
+    """
+    if (end_date - start_date).days + 1 <= max_hourly_days:
+        columns = STATION_DAY_HOUR_COLUMNS
+        query = sql.SQL("""
+            SELECT {}
+            FROM fct_station_day_hour_summary
+            WHERE station_name = ANY(%s) AND date BETWEEN %s AND %s
+            ORDER BY date, hour, station_name
+        """).format(projection(columns))
+    else:
+        columns = STATION_DAY_COLUMNS
+        query = sql.SQL("""
+            SELECT {}
+            FROM (
+                SELECT
+                    date,
+                    station_name,
+                    sum(arrival_delay_sum_min) / nullif(sum(arrival_delay_count), 0) AS avg_arrival_delay_min,
+                    sum(departure_delay_sum_min) / nullif(sum(departure_delay_count), 0) AS avg_departure_delay_min
+                FROM fct_station_day_hour_summary
+                WHERE station_name = ANY(%s) AND date BETWEEN %s AND %s
+                GROUP BY date, station_name
+            ) daily
+            ORDER BY date, station_name
+        """).format(projection(columns))
+    return fetch_frame(pool, query, columns, (list(stations), start_date, end_date))
@@ -0,0 +1,45 @@
+import warnings
+from collections import namedtuple
+
+import numpy as np
+
+Extremes = namedtuple("Extremes", [
+    "max", "min", "max_labels", "min_labels", "mean", "total", "max_share", "min_share",
+])
+
+def summarize(frame, label, metrics):
+    """
+    Compute every figure the insight texts need for the given metric columns in one
+    vectorized pass: maximum and minimum, the `label` values tied at each, mean,
+    total and the share (in percent) of the maximum and minimum in the total.
+    NaN values are skipped like pandas does. Returns {metric: Extremes}.
+    """
+    metrics = list(metrics)
+    values = frame[metrics].to_numpy(dtype="float64")
+    labels = frame[label].to_numpy()
+
+    with warnings.catch_warnings():
+        # all-NaN columns yield NaN instead of a warning
+        warnings.simplefilter("ignore", RuntimeWarning)
+        maxima = np.nanmax(values, axis=0)
+        minima = np.nanmin(values, axis=0)
+        means = np.nanmean(values, axis=0)
+    totals = np.nansum(values, axis=0)
+    safe_totals = np.where(totals > 0, totals, 1)
+    max_shares = np.where(totals > 0, maxima / safe_totals * 100, 0)
+    min_shares = np.where(totals > 0, minima / safe_totals * 100, 0)
+
+    is_max = values == maxima
+    is_min = values == minima
+
+    return {
+        metric: Extremes(
+            maxima[i], minima[i],
+            labels[is_max[:, i]].tolist(), labels[is_min[:, i]].tolist(),
+            means[i], totals[i], max_shares[i], min_shares[i],
+        )
+        for i, metric in enumerate(metrics)
+    }
+
+def join_labels(labels, template="{}"):
+    return ", ".join(template.format(label) for label in labels)
@@ -0,0 +1,71 @@
+import argparse
+import os
+import threading
+
+import psycopg
+from dotenv import load_dotenv
+from psycopg import sql
+
+from ingestion.utils import TABLE_CHANGES_CHANNEL, notify_table_changes
+
+# How long a listener waits for notifications before checking whether to stop
+LISTEN_TIMEOUT_SECONDS = 5.0
+MAX_RECONNECT_DELAY_SECONDS = 60
+
+def listen(conn_string, on_change, stop=None, channel=TABLE_CHANGES_CHANNEL):
+    """
+    LISTEN on `channel` and call on_change(table_name) for every notification until
+    `stop` is set. The connection is re-established with exponential backoff; after
+    a reconnect on_change(None) is called since notifications may have been missed.
+    """
+    stop = stop or threading.Event()
+    delay = 1
+    connected_before = False
+    while not stop.is_set():
+        try:
+            with psycopg.connect(conn_string, autocommit=True) as conn:
+                conn.execute(sql.SQL("LISTEN {};").format(sql.Identifier(channel)))
+                if connected_before:
+                    on_change(None)
+                connected_before = True
+                delay = 1
+                while not stop.is_set():
+                    for notify in conn.notifies(timeout=LISTEN_TIMEOUT_SECONDS):
+                        on_change(notify.payload)
+        except psycopg.Error as e:
+            print(f"Table change listener disconnected. Error: {e}")
+            stop.wait(delay)
+            delay = min(delay * 2, MAX_RECONNECT_DELAY_SECONDS)
+
+def start_listener(conn_string, on_change, channel=TABLE_CHANGES_CHANNEL):
+    """
+    Run listen() in a daemon thread. Returns the stop event of the listener.
+    """
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=listen, args=(conn_string, on_change, stop, channel),
+        name="table-change-listener", daemon=True,
+    )
+    thread.start()
+    return stop
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Print or send table change notifications.")
+    parser.add_argument("--notify", nargs="+", metavar="TABLE",
+                        help="send a notification for these tables instead of listening")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    load_dotenv()
+    conn_string = os.getenv('DATABASE_URL')
+    args = parse_args()
+    if args.notify:
+        with psycopg.connect(conn_string) as conn:
+            with conn.cursor() as cur:
+                notify_table_changes(cur, *args.notify)
+        print(f"Notified {', '.join(args.notify)}")
+    else:
+        try:
+            listen(conn_string, lambda table: print(f"Changed: {table}", flush=True))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,114 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from .data import MART_COLUMNS, MART_KEYS, MART_ORDER, load_table, table_version
+
+# Local Arrow copies of the mart tables, shared by all dashboard processes on a host
+SNAPSHOT_DIR = os.getenv(
+    'DASHBOARD_SNAPSHOT_DIR',
+    os.path.join(os.path.expanduser("~"), ".cache", "deutschebahnalytics", "snapshots"),
+)
+
+# dbt stamps mart rows with the updated_at of the raw rows they aggregate, which
+# can be older than rows already in the snapshot; re-read this window to catch them
+SNAPSHOT_LOOKBACK = timedelta(minutes=int(os.getenv('SNAPSHOT_LOOKBACK_MINUTES', '10')))
+
+def snapshot_path(table_name, directory=SNAPSHOT_DIR):
+    return os.path.join(directory, f"{table_name}.arrow")
+
+def read_snapshot(path):
+    """
+    Memory-map a snapshot file and return it as a DataFrame, or None if it is
+    missing or unreadable.
+    """
+    try:
+        with pa.memory_map(path) as source:
+            return ipc.open_file(source).read_all().to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+def write_snapshot(path, frame):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with ipc.new_file(tmp_path, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def sort_rows(frame, order):
+    """
+    Sort a frame by `order` ([(column, ascending)]), like load_table does in SQL.
+    """
+    return frame.sort_values(
+        [name for name, _ in order], ascending=[ascending for _, ascending in order], ignore_index=True
+    )
+
+def merge_rows(frame, delta, keys, order):
+    """
+    Replace the rows of `frame` whose keys appear in `delta` and append new ones,
+    keeping the rows in `order`.
+    """
+    changed = frame.set_index(keys).index.isin(delta.set_index(keys).index)
+    return sort_rows(pd.concat([frame[~changed], delta], ignore_index=True), order)
+
+def refresh_snapshot(pool, table_name, columns, keys, order, directory=SNAPSHOT_DIR):
+    """
+    Bring the local snapshot of a mart table up to date and return it.
+    Only rows updated since the snapshot's watermark (its max updated_at), minus
+    SNAPSHOT_LOOKBACK, are read from the database. The lookback is read on every
+    refresh, since a row can change without moving the watermark. The table is
+    loaded in full when there is no snapshot yet or the row count no longer
+    matches, e.g. after a full refresh.
+    """
+    columns = {**columns, "updated_at": "datetime64[ns, UTC]"}
+    path = snapshot_path(table_name, directory)
+    frame = read_snapshot(path)
+    row_count, _ = table_version(pool, table_name)
+
+    if frame is not None and list(frame.columns) == list(columns) and not frame.empty:
+        watermark = frame["updated_at"].max()
+        delta = load_table(pool, table_name, columns, since=watermark - SNAPSHOT_LOOKBACK, order=order)
+        if len(frame) == row_count and len(frame.merge(delta)) == len(delta):
+            # Every row read back is already in the snapshot as it is; snapshots
+            # written before MART_ORDER existed are sorted by key
+            return sort_rows(frame, order)
+        frame = merge_rows(frame, delta, keys, order)
+        if len(frame) != row_count:
+            frame = None
+    else:
+        frame = None
+
+    if frame is None:
+        frame = load_table(pool, table_name, columns, order=order)
+
+    try:
+        write_snapshot(path, frame)
+    except OSError as e:
+        print(f"Could not write snapshot {path}. Error: {e}")
+    return frame
+
+def load_snapshots(pool, tables=MART_COLUMNS, directory=SNAPSHOT_DIR):
+    """
+    Refresh the snapshots of several mart tables concurrently.
+    Returns {table_name: DataFrame} without the updated_at column; the table version
+    (row count, max updated_at) is kept in each frame's attrs["version"].
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(len(tables), pool.max_size))) as executor:
+        futures = {
+            table_name: executor.submit(
+                refresh_snapshot, pool, table_name, columns, MART_KEYS[table_name], MART_ORDER[table_name], directory
+            )
+            for table_name, columns in tables.items()
+        }
+        frames = {}
+        for table_name, future in futures.items():
+            frame = future.result()
+            version = (len(frame), str(frame["updated_at"].max()))
+            frames[table_name] = frame.drop(columns="updated_at")
+            frames[table_name].attrs["version"] = version
+        return frames
@@ -0,0 +1,107 @@
+import time
+
+# rchg only covers the last two minutes, so a longer gap between two successful
+# polls of a station may have lost changes and requires a fresh fchg snapshot
+MAX_DELTA_GAP_SECONDS = 110
+
+# Flushes a stop that matches no raw_timetable row is retried before it is dropped
+UNMATCHED_RETRIES = 30
+
+# Forget stops that no snapshot or delta mentioned for this many seconds
+STOP_MAX_AGE_SECONDS = 6 * 60 * 60
+
+class ChangeEngine:
+    """
+    In-memory view of the actual arrival and departure times of every station,
+    keyed by service_id. Each station is seeded from its fchg (full changes)
+    snapshot and kept current by merging rchg deltas; stops whose times changed
+    are marked dirty and handed out by pending_rows() for the next flush.
+    """
+    def __init__(self, max_gap=MAX_DELTA_GAP_SECONDS, max_age=STOP_MAX_AGE_SECONDS):
+        self.max_gap = max_gap
+        self.max_age = max_age
+        self.stations = {}
+        self.last_seen = {}
+        self.stop_seen = {}
+        self.dirty = {}
+
+    def needs_snapshot(self, eva_number):
+        last_seen = self.last_seen.get(str(eva_number))
+        return last_seen is None or time.monotonic() - last_seen > self.max_gap
+
+    def touch(self, eva_number):
+        """
+        Record a successful poll that carried no new changes.
+        """
+        self.last_seen[str(eva_number)] = time.monotonic()
+
+    def load_snapshot(self, eva_number, changes):
+        """
+        Replace the state of a station with an fchg snapshot. Stops that are no
+        longer part of the snapshot are forgotten.
+        """
+        eva_number = str(eva_number)
+        now = time.monotonic()
+        previous = self.stations.get(eva_number, {})
+        state = {}
+        for service_id, arrival, departure in changes:
+            state[service_id] = (arrival, departure)
+            self.stop_seen[(eva_number, service_id)] = now
+            if previous.get(service_id) != state[service_id]:
+                self.dirty.setdefault((eva_number, service_id), 0)
+        for service_id in previous.keys() - state.keys():
+            self.stop_seen.pop((eva_number, service_id), None)
+        self.stations[eva_number] = state
+        self.touch(eva_number)
+
+    def merge_delta(self, eva_number, changes):
+        """
+        Merge rchg changes into the state of a station. A change without a time
+        keeps the time already known for that stop.
+        """
+        eva_number = str(eva_number)
+        now = time.monotonic()
+        state = self.stations.setdefault(eva_number, {})
+        for service_id, arrival, departure in changes:
+            self.stop_seen[(eva_number, service_id)] = now
+            known_arrival, known_departure = state.get(service_id, (None, None))
+            merged = (arrival or known_arrival, departure or known_departure)
+            if merged != (known_arrival, known_departure) or service_id not in state:
+                state[service_id] = merged
+                self.dirty.setdefault((eva_number, service_id), 0)
+        self.touch(eva_number)
+
+    def pending_rows(self):
+        """
+        Return change rows (eva_number, service_id, actual_arrival_time,
+        actual_departure_time) for every dirty stop.
+        """
+        rows = []
+        for eva_number, service_id in self.dirty:
+            arrival, departure = self.stations.get(eva_number, {}).get(service_id, (None, None))
+            rows.append((eva_number, service_id, arrival, departure))
+        return rows
+
+    def mark_flushed(self, rows, unmatched_keys):
+        """
+        Clear the dirty flag of flushed stops. Stops that matched no timetable row
+        stay dirty for a limited number of flushes, e.g. until their plan is loaded.
+        """
+        for eva_number, service_id, _, _ in rows:
+            key = (eva_number, service_id)
+            attempts = self.dirty.pop(key, 0)
+            if key in unmatched_keys and attempts + 1 < UNMATCHED_RETRIES:
+                self.dirty[key] = attempts + 1
+        self.prune(time.monotonic())
+
+    def prune(self, now):
+        """
+        Forget the stops not mentioned for `max_age` seconds, e.g. trains that ran
+        hours ago, unless they still wait to be flushed. The daemon only reloads a
+        snapshot after missed polls, so its state would otherwise only grow.
+        """
+        for key, seen in list(self.stop_seen.items()):
+            if now - seen >= self.max_age and key not in self.dirty:
+                eva_number, service_id = key
+                del self.stop_seen[key]
+                self.stations.get(eva_number, {}).pop(service_id, None)
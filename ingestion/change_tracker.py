@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import time
+
+# Forget stops that have not been seen in rchg for this many seconds
+STATE_MAX_AGE_SECONDS = 6 * 60 * 60
+
+def isoformat(value):
+    return value.isoformat() if value is not None else None
+
+class ChangeTracker:
+    """
+    Remembers what update_timetables last applied so repeated rchg payloads and
+    stops whose actual times did not change are not written again.
+    State is kept in memory and, when `path` is given, persisted as a small JSON
+    file so one-shot runs can share it.
+    """
+    def __init__(self, path=None, max_age=STATE_MAX_AGE_SECONDS):
+        self.path = path
+        self.max_age = max_age
+        self.payload_hashes = {}
+        self.pending_hashes = {}
+        self.applied = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    def is_duplicate_payload(self, eva_number, payload):
+        """
+        Return True if the station returned exactly the same payload as the last
+        successfully applied poll. The new hash only sticks once mark_applied runs.
+        """
+        digest = hashlib.blake2b(payload, digest_size=16).hexdigest()
+        if self.payload_hashes.get(str(eva_number)) == digest:
+            return True
+        self.pending_hashes[str(eva_number)] = digest
+        return False
+
+    def changed_rows(self, rows):
+        """
+        Keep only change rows (eva_number, service_id, actual_arrival_time,
+        actual_departure_time) that differ from the last applied state.
+        """
+        changed = []
+        for eva_number, service_id, arrival, departure in rows:
+            state = self.applied.get(f"{eva_number}|{service_id}")
+            if state is None or state[:2] != [isoformat(arrival), isoformat(departure)]:
+                changed.append((eva_number, service_id, arrival, departure))
+        return changed
+
+    def mark_applied(self, rows, updated_keys):
+        """
+        Record the rows that were written to raw_timetable. Rows that matched no
+        timetable row (e.g. the plan is not loaded yet) are retried next poll.
+        """
+        now = time.time()
+        incomplete = set()
+        for eva_number, service_id, arrival, departure in rows:
+            if (eva_number, service_id) in updated_keys:
+                self.applied[f"{eva_number}|{service_id}"] = [isoformat(arrival), isoformat(departure), now]
+            else:
+                incomplete.add(str(eva_number))
+        for eva_number, digest in self.pending_hashes.items():
+            if eva_number not in incomplete:
+                self.payload_hashes[eva_number] = digest
+        self.pending_hashes = {}
+        self.prune(now)
+
+    def prune(self, now):
+        self.applied = {
+            key: state for key, state in self.applied.items()
+            if now - state[2] < self.max_age
+        }
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.payload_hashes = state["payloads"]
+            self.applied = state["applied"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable change state {self.path}. Error: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"payloads": self.payload_hashes, "applied": self.applied}, f)
+        os.replace(tmp_path, self.path)
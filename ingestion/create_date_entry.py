@@ -1,7 +1,9 @@
+import argparse
 import os
 import psycopg
 from datetime import datetime
 from dotenv import load_dotenv
+from . import metrics
 
 load_dotenv()
 
@@ -13,6 +15,7 @@ def save_to_db(conn, date):
     conn.commit()
     cur.close()
 
+@metrics.run("create_date_entry")
 def main():
     conn = psycopg.connect(conn_string)
     # Fetch current date
@@ -21,5 +24,12 @@ def main():
     save_to_db(conn, dt)
     conn.close()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Record today's date in data_dates.")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    with metrics.profile(args.profile):
+        main()
\ No newline at end of file
@@ -1,57 +1,137 @@
-import requests
+import argparse
 import psycopg
 from dotenv import load_dotenv
 import os
+from . import metrics
+from .http_client import DB_API_BASE_URL, ApiClient
+from .utils import copy_rows, notify_table_changes
 
 load_dotenv()
 
 conn_string = os.getenv('DATABASE_URL')
 
-DB_CLIENT_ID = os.getenv('Client_ID')
-DB_CLIENT_SECRET = os.getenv('Client_Secret')
-
-# API endpoint
-STADA_API_URL = "https://apis.deutschebahn.com/db-api-marketplace/apis/station-data/v2/stations"
-headers = {
-    "DB-Client-ID": DB_CLIENT_ID,
-    "DB-Api-Key": DB_CLIENT_SECRET,
-    "accept": "application/json"
-}
-
-try:
-    # Fetch stations
-    response = requests.get(STADA_API_URL, headers=headers)
-    stations = response.json()
-
-    stations = stations["result"]
-
-    try:
-        with psycopg.connect(conn_string) as conn:
-            print("Connection established")
-            
-            with conn.cursor() as cur:
-                for station in stations:
-                    cur.execute(
-                        "INSERT INTO raw_stations (id, name, city, cordinates, zipcode, federal_state, eva_number) \
-                        VALUES (%s,%s,%s,%s,%s,%s,%s)", 
-                        (
-                            station['number'], 
-                            station['name'], 
-                            station['mailingAddress']['city'], 
-                            f"({station["evaNumbers"][0]["geographicCoordinates"]["coordinates"][0]}, {station["evaNumbers"][0]["geographicCoordinates"]["coordinates"][1]})",
-                            station['mailingAddress']['zipcode'], 
-                            station['federalState'], 
-                            station['evaNumbers'][0]["number"]
-                        )
-                    )
-                    conn.commit()
-                    print(f"Data for {station['name']} inserted successfully")
-        
-    except Exception as e:
-        print("Error inserting stations: ", e)
-except Exception as e:
-    print("Error fetching stations: ", e)
-# conn.commit()
-cur.close()
-conn.close()
-print("Stations updated successfully")
+STADA_API_URL = DB_API_BASE_URL + "/station-data/v2/stations"
+
+# A sync deletes every station missing from the catalog, so refuse to apply a
+# catalog that lost more than this share of the stations we already have
+MAX_DELETE_FRACTION = float(os.getenv('STATION_SYNC_MAX_DELETE_FRACTION', '0.1'))
+
+STATION_COLUMNS = (
+    "id",
+    "name",
+    "city",
+    "latitude",
+    "longitude",
+    "zipcode",
+    "federal_state",
+    "eva_number",
+)
+
+def fetch_stations(client):
+    """
+    Fetch the full StaDa station catalog.
+    """
+    response = client.get(STADA_API_URL, endpoint="stada", timeout=60)
+    return response.json()["result"]
+
+def station_rows(stations):
+    """
+    Yield raw_stations rows for the given StaDa stations, one per station number.
+    The first EVA number of a station is its main one; GeoJSON coordinates are [lon, lat].
+    """
+    seen = set()
+    for station in stations:
+        if station["number"] in seen:
+            continue
+        seen.add(station["number"])
+        address = station.get("mailingAddress", {})
+        eva_numbers = station.get("evaNumbers") or [{}]
+        coordinates = eva_numbers[0].get("geographicCoordinates", {}).get("coordinates") or (None, None)
+        yield (
+            station["number"],
+            station["name"],
+            address.get("city"),
+            coordinates[1],
+            coordinates[0],
+            address.get("zipcode"),
+            station.get("federalState"),
+            eva_numbers[0].get("number"),
+        )
+
+def sync_stations(conn, rows, max_delete_fraction=MAX_DELETE_FRACTION):
+    """
+    Make raw_stations match the catalog rows in one transaction: COPY them into a
+    staging table, then delete stations that left the catalog, update the ones that
+    changed and insert new ones, matching on station number.
+    Returns (inserted, updated, deleted).
+    """
+    columns = ", ".join(STATION_COLUMNS)
+    changed = " OR ".join(f"s.{column} IS DISTINCT FROM c.{column}" for column in STATION_COLUMNS[1:])
+    assignments = ", ".join(f"{column} = c.{column}" for column in STATION_COLUMNS[1:])
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE raw_stations_staging ON COMMIT DROP AS
+            SELECT {columns} FROM raw_stations WITH NO DATA;
+        """)
+        total = copy_rows(cur, "raw_stations_staging", STATION_COLUMNS, rows)
+
+        cur.execute("""
+            SELECT count(*) FROM raw_stations s
+            WHERE NOT EXISTS (SELECT 1 FROM raw_stations_staging c WHERE c.id = s.id);
+        """)
+        missing = cur.fetchone()[0]
+        cur.execute("SELECT count(*) FROM raw_stations;")
+        existing = cur.fetchone()[0]
+        if total == 0 or missing > existing * max_delete_fraction:
+            conn.rollback()
+            raise ValueError(
+                f"Refusing to sync a catalog of {total} stations that would delete {missing} of {existing}"
+            )
+
+        cur.execute("""
+            DELETE FROM raw_stations s
+            WHERE NOT EXISTS (SELECT 1 FROM raw_stations_staging c WHERE c.id = s.id);
+        """)
+        deleted = cur.rowcount
+        cur.execute(f"""
+            UPDATE raw_stations s SET {assignments}
+            FROM raw_stations_staging c
+            WHERE s.id = c.id AND ({changed});
+        """)
+        updated = cur.rowcount
+        cur.execute(f"""
+            INSERT INTO raw_stations ({columns})
+            SELECT {columns} FROM raw_stations_staging
+            ON CONFLICT (id) DO NOTHING;
+        """)
+        inserted = cur.rowcount
+        if inserted or updated or deleted:
+            notify_table_changes(cur, "raw_stations")
+    conn.commit()
+    return inserted, updated, deleted
+
+@metrics.run("fetch_stations")
+def main(max_delete_fraction=MAX_DELETE_FRACTION):
+    with ApiClient("application/json") as client:
+        stations = fetch_stations(client)
+    print(f"Fetched {len(stations)} stations")
+
+    conn = psycopg.connect(conn_string)
+    with metrics.stage("db_write"):
+        inserted, updated, deleted = sync_stations(conn, station_rows(stations), max_delete_fraction)
+    metrics.count("rows_written", inserted + updated + deleted)
+    metrics.count("rows_skipped", len(stations) - inserted - updated)
+    print(f"Stations synced: {inserted} inserted, {updated} updated, {deleted} deleted")
+    conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Sync raw_stations with the StaDa station catalog.")
+    parser.add_argument("--max-delete-fraction", type=float, default=MAX_DELETE_FRACTION,
+                        help="abort if the catalog would delete more than this share of the stored stations")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with metrics.profile(args.profile):
+        main(args.max_delete_fraction)
@@ -1,88 +1,209 @@
+import argparse
 import requests
 import psycopg
 from dotenv import load_dotenv
 import os
-from datetime import datetime
-from .utils import STATION_NAMES, fetch_eva_number, parse_planned_timetable
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from . import metrics
+from .http_client import DB_API_BASE_URL, PLAN_REQUESTS_PER_MINUTE, ApiClient
+from .partitions import ensure_partitions
+from .station_cache import load_stations
+from .utils import copy_rows, iter_planned_timetable, notify_table_changes, stop_key
 
 load_dotenv()
 
 conn_string = os.getenv('DATABASE_URL')
 
-DB_CLIENT_ID = os.getenv('Client_ID')
-DB_CLIENT_SECRET = os.getenv('Client_Secret')
-
-# API endpoint
-PLANNED_TIMETABLE_API = "https://apis.deutschebahn.com/db-api-marketplace/apis/timetables/v1/plan/"
-
-headers = {
-    "DB-Client-ID": DB_CLIENT_ID,
-    "DB-Api-Key": DB_CLIENT_SECRET,
-    "accept": "application/xml"
-}
-
-def fetch_planned_timetable(eva_no,date,hour):
-    response = requests.get(PLANNED_TIMETABLE_API + str(eva_no) + f"/{date}/{hour}", headers=headers)
-    if response.status_code == 200:
-        return response.text
-    else:
-        print(f"Failed for {eva_no}: {response.status_code}")
-        return None
+PLANNED_TIMETABLE_API = DB_API_BASE_URL + "/timetables/v1/plan/"
+
+# Number of plan requests kept in flight
+MAX_CONCURRENT_REQUESTS = int(os.getenv('MAX_CONCURRENT_REQUESTS', '8'))
+
+# Number of hourly plan slices fetched per station, starting with the current hour
+PREFETCH_HOURS = int(os.getenv('PLAN_PREFETCH_HOURS', '1'))
+
+def fetch_planned_timetable(eva_no, date, hour, client):
+    with metrics.station(eva_no):
+        response = client.get(PLANNED_TIMETABLE_API + str(eva_no) + f"/{date}/{hour}", endpoint="plan")
+    return response.content
     
-def save_to_db(conn, eva_number, stops):
-    data = []
-    for service_id, stop in stops.items():
-        data.append((
-            eva_number,
-            service_id,
-            stop["train_category"],
-            stop["train_number"],
-            stop["train_operator"],
-            stop["platform"],
-            stop["route_before_arrival"],
-            stop["route_after_departure"],
-            stop["planned_arrival_time"],
-            stop["planned_departure_time"],  
-        ))
-
-    insert_query = """
-        INSERT INTO raw_timetable (
-            eva_number,
-            service_id,
-            train_category,
-            train_number,
-            train_operator,
-            platform,
-            route_before_arrival,
-            route_after_departure,
-            planned_arrival_time,
-            planned_departure_time
-        )
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (eva_number, service_id, train_category, train_number, train_operator, platform, route_before_arrival, route_after_departure, planned_arrival_time, planned_departure_time) DO NOTHING;
+TIMETABLE_COLUMNS = (
+    "stop_key",
+    "eva_number",
+    "service_id",
+    "train_category",
+    "train_number",
+    "train_operator",
+    "platform",
+    "route_before_arrival",
+    "route_after_departure",
+    "planned_arrival_time",
+    "planned_departure_time",
+    "planned_date",
+)
+
+def save_to_db(conn, rows, slices=()):
+    """
+    Bulk load timetable rows: COPY them into an unlogged, session-private staging
+    table and merge the whole batch into raw_timetable with one INSERT ... SELECT.
+    The plan slices the rows came from, as (eva_number, slice_start, stops), are
+    recorded in the same transaction.
+    Returns (inserted, skipped) where skipped rows were already present.
+    """
+    columns = ", ".join(TIMETABLE_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE raw_timetable_staging ON COMMIT DROP AS
+            SELECT {columns} FROM raw_timetable WITH NO DATA;
+        """)
+        total = copy_rows(cur, "raw_timetable_staging", TIMETABLE_COLUMNS, rows)
+        cur.execute(f"""
+            INSERT INTO raw_timetable ({columns})
+            SELECT {columns} FROM raw_timetable_staging
+            ON CONFLICT (stop_key, planned_date) DO NOTHING;
+        """)
+        inserted = cur.rowcount
+        if inserted:
+            notify_table_changes(cur, "raw_timetable")
+        cur.executemany("""
+            INSERT INTO loaded_plan_slices (eva_number, slice_start, stops)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (eva_number, slice_start) DO UPDATE
+            SET stops = EXCLUDED.stops, loaded_at = now();
+        """, slices)
+    conn.commit()
+    return inserted, total - inserted
+
+def plan_slices(start, hours):
+    start = start.replace(minute=0, second=0, microsecond=0)
+    return [start + timedelta(hours=i) for i in range(hours)]
+
+def loaded_plan_slices(conn, eva_numbers, slices):
+    """
+    Return the (eva_number, slice_start) pairs that have already been loaded.
     """
     with conn.cursor() as cur:
-        cur.executemany(insert_query, data)
+        cur.execute("""
+            SELECT eva_number, slice_start FROM loaded_plan_slices
+            WHERE eva_number = ANY(%s) AND slice_start = ANY(%s);
+        """, ([str(eva_number) for eva_number in eva_numbers], slices))
+        rows = cur.fetchall()
     conn.commit()
+    return set(rows)
 
-def main():
+def fetch_planned_timetables(plan_requests, max_workers=MAX_CONCURRENT_REQUESTS,
+                             requests_per_minute=PLAN_REQUESTS_PER_MINUTE):
+    """
+    Fetch (eva_number, slice_start) plan slices concurrently through one API client
+    limited to `requests_per_minute`. Yields ((eva_number, slice_start), response)
+    pairs in completion order; response is None when the slice could not be fetched.
+    """
+    with ApiClient("application/xml", requests_per_minute, pool_size=max_workers) as client:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {
+                pool.submit(
+                    fetch_planned_timetable,
+                    eva_number,
+                    slice_start.strftime('%y%m%d'),
+                    slice_start.strftime('%H'),
+                    client,
+                ): (eva_number, slice_start)
+                for eva_number, slice_start in plan_requests
+            }
+            for future in as_completed(futures):
+                plan_request = futures[future]
+                try:
+                    yield plan_request, future.result()
+                except requests.exceptions.RequestException as e:
+                    print(f"Failed for {plan_request[0]}: {e}")
+                    yield plan_request, None
+
+@metrics.run("fetch_timetables")
+def main(hours=PREFETCH_HOURS, force=False, stations=None, requests_per_minute=PLAN_REQUESTS_PER_MINUTE,
+         progress=None):
+    """
+    Load the plan slices of `stations` (Station records, the STATION_NAMES stations
+    by default), sending at most `requests_per_minute` requests, e.g. the share of
+    a sharded run. Slices that failed are not recorded and are fetched by the next run.
+    progress(done, total) is called as plan slices complete.
+    """
     conn = psycopg.connect(conn_string)
-    # Fetch current date and time and convert to string
-    dt = datetime.now()
-    date_str = dt.strftime('%y%m%d')
-    hour_str = dt.strftime('%H')
+    # Hourly slices from the current hour on
+    slices = plan_slices(datetime.now(), hours)
+
+    if stations is None:
+        with metrics.stage("station_lookup"):
+            stations = load_stations(conn).values()
+    eva_numbers = [station.eva_number for station in stations]
+
+    # Skip slices that an earlier run already loaded
+    with metrics.stage("skip_check"):
+        loaded = set() if force else loaded_plan_slices(conn, eva_numbers, slices)
+    plan_requests = [
+        (eva_number, slice_start)
+        for eva_number in eva_numbers
+        for slice_start in slices
+        if (str(eva_number), slice_start) not in loaded
+    ]
+    print(f"Fetching {len(plan_requests)} plan slices, {len(eva_numbers) * len(slices) - len(plan_requests)} already loaded")
 
-    # Iterate through each station
-    # states = fetch_states(conn)
-    for station in STATION_NAMES:
-        eva_number = fetch_eva_number(conn, station)
+    # Fetch planned timetables concurrently, dedupe stops across slices and load them as one batch
+    stops = {}
+    fetched_slices = []
+    plan_responses = fetch_planned_timetables(plan_requests, requests_per_minute=requests_per_minute)
+    for done, ((eva_number, slice_start), planned_trips) in enumerate(plan_responses, 1):
+        if progress is not None:
+            progress(done, len(plan_requests))
+        if planned_trips is None:
+            metrics.count("slices_failed")
+            continue
+        with metrics.station(eva_number):
+            try:
+                with metrics.stage("parse"):
+                    slice_stops = list(metrics.counted(iter_planned_timetable(planned_trips), "stops_parsed"))
+            except (ET.ParseError, ValueError) as e:
+                # Like a failed request: the slice is not recorded and is fetched by the next run
+                print(f"Could not parse the plan of {eva_number} at {slice_start:%H}:00. Error: {e}")
+                metrics.count("parse_errors")
+                metrics.count("slices_failed")
+                continue
+        for stop in slice_stops:
+            stops[(eva_number, stop.service_id)] = stop
+        fetched_slices.append((str(eva_number), slice_start, len(slice_stops)))
 
-        # Fetch planned timetable
-        planned_trips = fetch_planned_timetable(eva_number,date_str,hour_str)
-        parsed_planned_response = parse_planned_timetable(planned_trips)
-        save_to_db(conn, eva_number, parsed_planned_response)
+    with metrics.stage("build_rows"):
+        rows = []
+        for (eva_number, _), stop in stops.items():
+            row = (str(eva_number), *stop)
+            planned_time = stop.planned_arrival_time or stop.planned_departure_time
+            rows.append((stop_key(row), *row, planned_time.date() if planned_time else None))
+
+    # Make sure every planned date has its raw_timetable partition
+    with metrics.stage("db_partitions"):
+        ensure_partitions(conn, {row[-1] for row in rows if row[-1] is not None})
+    with metrics.stage("db_write"):
+        inserted, skipped = save_to_db(conn, rows, fetched_slices)
+    metrics.count("slices_loaded", len(fetched_slices))
+    metrics.count("rows_written", inserted)
+    metrics.count("rows_skipped", skipped)
+    print(f"Timetables saved: {inserted} inserted, {skipped} already present")
 
     conn.close()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load planned timetables into raw_timetable.")
+    parser.add_argument("--hours", type=int, default=PREFETCH_HOURS,
+                        help="number of hourly plan slices to fetch, starting with the current hour")
+    parser.add_argument("--force", action="store_true",
+                        help="fetch slices again even if they were already loaded")
+    parser.add_argument("--requests-per-minute", type=int, default=PLAN_REQUESTS_PER_MINUTE,
+                        help="share of the API quota used by this job")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    with metrics.profile(args.profile):
+        main(args.hours, args.force, requests_per_minute=args.requests_per_minute)
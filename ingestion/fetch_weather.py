@@ -1,10 +1,14 @@
+import argparse
 import os
 import requests
 import psycopg
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from dotenv import load_dotenv
 
-from .utils import STATION_NAMES
+from . import metrics
+from .http_client import ApiClient
+from .station_cache import load_stations
 
 # Load environment variables
 load_dotenv()
@@ -13,14 +17,34 @@ conn_string = os.getenv('DATABASE_URL')
 
 API_KEY = os.getenv("WEATHER_API_KEY")
 
-def fetch_weather(lat: float, lon: float, lang: str = "en") -> dict:
+WEATHER_API_URL = "https://api.weatherapi.com/v1/current.json"
+
+# Number of weather requests kept in flight
+WEATHER_MAX_CONCURRENT_REQUESTS = int(os.getenv('WEATHER_MAX_CONCURRENT_REQUESTS', '8'))
+
+# Attempts per location and the base delay of the jittered exponential backoff between them
+WEATHER_MAX_ATTEMPTS = int(os.getenv('WEATHER_MAX_ATTEMPTS', '3'))
+WEATHER_BACKOFF_SECONDS = float(os.getenv('WEATHER_BACKOFF_SECONDS', '1'))
+
+# Stations whose coordinates round to the same grid cell share one weather lookup;
+# two decimals are roughly 1 km
+WEATHER_GRID_DECIMALS = int(os.getenv('WEATHER_GRID_DECIMALS', '2'))
+
+def weather_client(pool_size=10):
+    return ApiClient("application/json", pool_size=pool_size, max_attempts=WEATHER_MAX_ATTEMPTS,
+                     backoff=WEATHER_BACKOFF_SECONDS, db_api=False)
+
+def fetch_weather(lat: float, lon: float, lang: str = "en", client=None) -> dict:
     """
     Fetch current weather using WeatherAPI.com based on latitude and longitude.
+    Timeouts, connection errors, rate limiting and server errors are retried by
+    the API client.
     
     Args:
         lat (float): Latitude of location.
         lon (float): Longitude of location.
         lang (str): Language code for weather description (default: English).
+        client (ApiClient): Client to reuse connections from (optional).
     
     Returns:
         dict: Parsed JSON response containing current weather data.
@@ -28,19 +52,19 @@ def fetch_weather(lat: float, lon: float, lang: str = "en") -> dict:
     if not API_KEY:
         raise ValueError("Missing WEATHER_API_KEY in environment variables.")
 
-    url = "https://api.weatherapi.com/v1/current.json"
+    if client is None:
+        with weather_client() as client:
+            return fetch_weather(lat, lon, lang, client)
+
+    params = {
+        "key": API_KEY,
+        "q": f"{lat},{lon}",
+        "lang": lang
+    }
 
     try:
-        params = {
-            "key": API_KEY,
-            "q": f"{lat},{lon}",
-            "lang": lang
-        }
-
-        response = requests.get(url, params=params)
-        response.raise_for_status()
-        data = response.json()
-    except Exception as e:
+        data = client.get(WEATHER_API_URL, endpoint="weather", params=params).json()
+    except (requests.exceptions.RequestException, ValueError) as e:
         print(f"Error fetching weather. Error: {e}")
         return None
 
@@ -53,18 +77,6 @@ def fetch_weather(lat: float, lon: float, lang: str = "en") -> dict:
         "visibility": current["vis_km"]
     }
 
-def fetch_coordinates(conn, station):
-    query = """
-        SELECT cordinates from raw_stations WHERE name= %s;
-    """
-    with conn.cursor() as curr:
-        curr.execute(query, (station,))
-        result = curr.fetchone()
-        if result:
-            lon, lat = result[0].replace("(", "").replace(")","").split(",")
-            return (float(lat), float(lon)) # saved as lon, lat. We need lat, lon
-        return None
-
 def save_to_db(conn, data):
     insert_query = """
         INSERT INTO raw_weather (
@@ -85,31 +97,67 @@ def save_to_db(conn, data):
         cur.executemany(insert_query, data)
     conn.commit()
 
-if __name__ == "__main__":
+def grid_cell(lat, lon, decimals=WEATHER_GRID_DECIMALS):
+    return round(lat, decimals), round(lon, decimals)
+
+def fetch_weather_cells(cells, max_workers=WEATHER_MAX_CONCURRENT_REQUESTS):
+    """
+    Fetch the weather of (lat, lon) grid cells concurrently through one API client.
+    Yields (cell, weather) pairs in completion order; weather is None on failure.
+    """
+    with weather_client(pool_size=max_workers) as client:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(fetch_weather, *cell, client=client): cell for cell in cells}
+            for future in as_completed(futures):
+                yield futures[future], future.result()
+
+@metrics.run("fetch_weather")
+def main():
     dt = datetime.now()
     conn = psycopg.connect(conn_string)
+
+    # Group the stations by grid cell so nearby stations share one lookup
+    with metrics.stage("station_lookup"):
+        stations = load_stations(conn).values()
+    stations_by_cell = {}
+    for station in stations:
+        if station.latitude is not None:
+            cell = grid_cell(station.latitude, station.longitude)
+            stations_by_cell.setdefault(cell, []).append(station.name)
+    print(f"Fetching weather for {len(stations_by_cell)} grid cells")
+
     data = []
-    try:
-        for station in STATION_NAMES:
-            coordinates = fetch_coordinates(conn, station)
-            if coordinates:
-                latitude, longitude = coordinates
-                weather = fetch_weather(latitude, longitude)
-                if weather:
-                    data.append((
-                        station,
-                        dt.hour,
-                        weather["temperature"],
-                        weather["humidity"],
-                        weather["wind"],
-                        weather["condition"],
-                        weather["visibility"],
-                        dt,
-                        dt.date(),
-                    ))
-    
-    except requests.exceptions.RequestException as e:
-        print("Error fetching weather data:", e)
+    for cell, weather in fetch_weather_cells(stations_by_cell):
+        if not weather:
+            metrics.count("cells_failed")
+            continue
+        for name in stations_by_cell[cell]:
+            data.append((
+                name,
+                dt.hour,
+                weather["temperature"],
+                weather["humidity"],
+                weather["wind"],
+                weather["condition"],
+                weather["visibility"],
+                dt,
+                dt.date(),
+            ))
 
     if data:
-        save_to_db(conn, data)
+        with metrics.stage("db_write"):
+            save_to_db(conn, data)
+    metrics.count("rows_written", len(data))
+    print(f"Weather saved for {len(data)} stations")
+
+    conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load the current weather at every station into raw_weather.")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with metrics.profile(args.profile):
+        main()
@@ -0,0 +1,268 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+load_dotenv()
+
+# Credentials of the DB API Marketplace application, sent with every DB API request
+DB_CLIENT_ID = os.getenv('Client_ID')
+DB_CLIENT_SECRET = os.getenv('Client_Secret')
+
+# DB API Marketplace endpoint (override DB_API_BASE_URL to point at a local stub server)
+DB_API_BASE_URL = os.getenv('DB_API_BASE_URL', "https://apis.deutschebahn.com/db-api-marketplace/apis")
+
+# Per-minute quota of the DB API Marketplace Timetables API for one client (60 on the free plan)
+API_REQUESTS_PER_MINUTE = int(os.getenv('API_REQUESTS_PER_MINUTE', '60'))
+
+# Shares of that quota for the jobs that run at the same time: the update daemon,
+# the scheduled plan fetch and the sharded scheduler, which gets what is left
+UPDATE_REQUESTS_PER_MINUTE = int(os.getenv('UPDATE_REQUESTS_PER_MINUTE', '30'))
+PLAN_REQUESTS_PER_MINUTE = int(os.getenv('PLAN_REQUESTS_PER_MINUTE', '10'))
+SCHEDULER_REQUESTS_PER_MINUTE = int(os.getenv(
+    'SCHEDULER_REQUESTS_PER_MINUTE',
+    str(API_REQUESTS_PER_MINUTE - UPDATE_REQUESTS_PER_MINUTE - PLAN_REQUESTS_PER_MINUTE),
+))
+
+# Requests the limiter lets through back to back after an idle spell. The bucket
+# starts empty, so a run never sends more than the quota in its first minute either.
+API_BURST = int(os.getenv('API_BURST', '1'))
+
+# Attempts per request and the bounds of the jittered exponential backoff between them.
+# A Retry-After longer than HTTP_MAX_BACKOFF_SECONDS fails the request instead.
+HTTP_MAX_ATTEMPTS = int(os.getenv('HTTP_MAX_ATTEMPTS', '5'))
+HTTP_BACKOFF_SECONDS = float(os.getenv('HTTP_BACKOFF_SECONDS', '1'))
+HTTP_MAX_BACKOFF_SECONDS = float(os.getenv('HTTP_MAX_BACKOFF_SECONDS', '60'))
+HTTP_TIMEOUT_SECONDS = float(os.getenv('HTTP_TIMEOUT_SECONDS', '30'))
+
+# Consecutive failures after which an endpoint is no longer called, and for how long
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_SECONDS = float(os.getenv('CIRCUIT_RESET_SECONDS', '60'))
+
+# Server errors worth retrying; 429 is retried as well but does not count as a failure
+RETRY_STATUS_CODES = {500, 502, 503, 504}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting callers to `rate` acquisitions every `per` seconds.
+    It starts empty and saves up at most `burst` tokens, so no window of `per`
+    seconds sees more than `rate` plus `burst` acquisitions.
+    """
+    def __init__(self, rate, per=60.0, burst=API_BURST):
+        self.capacity = max(1, min(burst, rate))
+        self.tokens = 0.0
+        self.fill_rate = rate / per
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                else:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """
+        Hold every caller back for `seconds`, e.g. after the server answered 429, and
+        drop the saved-up tokens so requests resume at the steady rate, not in a burst.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+            self.updated = self.paused_until
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """
+    Raised instead of sending a request while the circuit of its endpoint is open.
+    """
+
+class CircuitBreaker:
+    """
+    Stop calling an endpoint after `threshold` consecutive failures. Once
+    `reset_seconds` have passed a single trial request is let through: success
+    closes the circuit again, failure keeps it open for another period.
+    """
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_seconds=CIRCUIT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    def before_request(self, endpoint):
+        with self.lock:
+            if self.opened_at is None:
+                return
+            if self.trial or time.monotonic() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError(f"Circuit of {endpoint} is open after {self.failures} failures")
+            self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+
+def create_session(headers, pool_size=10):
+    """
+    Create a requests session that keeps up to `pool_size` keep-alive connections per host.
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def retry_after(response):
+    """
+    Seconds to wait according to the Retry-After header (seconds or an HTTP date),
+    or None without a usable header.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def api_headers(accept, db_api=True):
+    """
+    Request headers accepting `accept`, with the DB API Marketplace credentials
+    unless `db_api` is off, e.g. for other providers.
+    """
+    headers = {"accept": accept}
+    if db_api:
+        headers.update({"DB-Client-ID": DB_CLIENT_ID, "DB-Api-Key": DB_CLIENT_SECRET})
+    return headers
+
+class ApiClient:
+    """
+    HTTP client shared by the ingestion jobs: one keep-alive session, an optional
+    token bucket of `requests_per_minute`, retries with jittered exponential backoff
+    and a circuit breaker per endpoint. Safe to use from several threads.
+    Requests accept `accept` and carry the DB API credentials unless `db_api` is off.
+    """
+    def __init__(self, accept="application/xml", requests_per_minute=None, pool_size=10,
+                 max_attempts=HTTP_MAX_ATTEMPTS, backoff=HTTP_BACKOFF_SECONDS, max_backoff=HTTP_MAX_BACKOFF_SECONDS,
+                 timeout=HTTP_TIMEOUT_SECONDS, burst=API_BURST, db_api=True):
+        self.session = create_session(api_headers(accept, db_api), pool_size)
+        self.limiter = TokenBucket(requests_per_minute, burst=burst) if requests_per_minute else None
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def breaker(self, endpoint):
+        with self.lock:
+            return self.breakers.setdefault(endpoint, CircuitBreaker())
+
+    def backoff_delay(self, attempt):
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, url, endpoint=None, **kwargs):
+        """
+        GET `url` once the rate limiter allows it. Connection errors, timeouts, 429
+        and server errors are retried after the server's Retry-After or a jittered
+        exponential backoff; a 429 also pauses every other caller of the limiter.
+        `endpoint` names the circuit breaker to use (the host by default); while it
+        is open the request fails fast with CircuitOpenError.
+        Returns the response, or raises a requests exception once it has failed.
+        """
+        endpoint = endpoint or urlsplit(url).netloc
+        breaker = self.breaker(endpoint)
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_attempts):
+            try:
+                breaker.before_request(endpoint)
+            except CircuitOpenError:
+                metrics.count("http_circuit_open")
+                raise
+            if self.limiter is not None:
+                with metrics.stage("rate_limit_wait"):
+                    self.limiter.acquire()
+
+            delay = None
+            throttled = False
+            metrics.count("http_requests")
+            if attempt:
+                metrics.count("http_retries")
+            try:
+                with metrics.stage("http"):
+                    response = self.session.get(url, **kwargs)
+            except requests.exceptions.RequestException as e:
+                breaker.record_failure()
+                error = e
+            else:
+                status = response.status_code
+                throttled = status == 429
+                if status in RETRY_STATUS_CODES:
+                    breaker.record_failure()
+                else:
+                    # Any other answer, including 429, shows the endpoint is up
+                    breaker.record_success()
+                if status < 400:
+                    metrics.count("bytes_fetched", len(response.content))
+                    return response
+                error = requests.exceptions.HTTPError(f"{status} {response.reason} from {endpoint}", response=response)
+                if throttled:
+                    metrics.count("http_throttled")
+                elif status not in RETRY_STATUS_CODES:
+                    metrics.count("http_failures")
+                    raise error
+                delay = retry_after(response)
+
+            if attempt + 1 == self.max_attempts or (delay is not None and delay > self.max_backoff):
+                break
+            if delay is None:
+                delay = self.backoff_delay(attempt)
+            if throttled and self.limiter is not None:
+                self.limiter.pause(delay)
+            else:
+                time.sleep(delay)
+        metrics.count("http_failures")
+        raise error
@@ -0,0 +1,281 @@
+import cProfile
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Optional outputs of the per-run metrics: a JSON lines file appended to ("-" for
+# stdout) and a node_exporter textfile collector directory receiving <job>.prom
+METRICS_JSONL_PATH = os.getenv('METRICS_JSONL_PATH')
+METRICS_TEXTFILE_DIR = os.getenv('METRICS_TEXTFILE_DIR')
+
+METRIC_PREFIX = "deutschebahnalytics_ingestion"
+
+class RunMetrics:
+    """
+    Stage timings and counters of one ingestion run, kept per station and summed
+    up for the run. Stage times are summed across threads, so concurrent stages can
+    add up to more than the run's wall time. Thread-safe.
+    """
+    def __init__(self, job, labels=None):
+        self.job = job
+        self.labels = dict(labels or {})
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.monotonic()
+        self.started_at = datetime.now(timezone.utc)
+        self.stages = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def record(self, station, stage, seconds):
+        with self.lock:
+            calls_seconds = self.stages.setdefault((station, stage), [0, 0.0])
+            calls_seconds[0] += 1
+            calls_seconds[1] += seconds
+
+    def add(self, station, name, value):
+        with self.lock:
+            self.counters[(station, name)] = self.counters.get((station, name), 0) + value
+
+    def stations(self):
+        """
+        Return {station: (stages, counters)} for every station with metrics;
+        station None holds what was not attributed to a station.
+        """
+        with self.lock:
+            stations = {}
+            for (station, stage), (calls, seconds) in self.stages.items():
+                stations.setdefault(station, ({}, {}))[0][stage] = {"calls": calls, "seconds": round(seconds, 6)}
+            for (station, name), value in self.counters.items():
+                stations.setdefault(station, ({}, {}))[1][name] = value
+            return stations
+
+    def totals(self):
+        """
+        Return (stages, counters) summed over all stations.
+        """
+        stages = {}
+        counters = {}
+        for station_stages, station_counters in self.stations().values():
+            for stage, values in station_stages.items():
+                total = stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+                total["calls"] += values["calls"]
+                total["seconds"] = round(total["seconds"] + values["seconds"], 6)
+            for name, value in station_counters.items():
+                counters[name] = counters.get(name, 0) + value
+        return stages, counters
+
+    def records(self, status):
+        """
+        JSON lines records: one per station, then one for the whole run.
+        """
+        base = {
+            "time": datetime.now(timezone.utc).isoformat(),
+            "run_id": self.run_id,
+            "job": self.job,
+            "labels": self.labels,
+        }
+        records = [
+            {**base, "station": str(station), "stages": stages, "counters": counters}
+            for station, (stages, counters) in self.stations().items()
+            if station is not None
+        ]
+        stages, counters = self.totals()
+        records.append({
+            **base,
+            "station": None,
+            "status": status,
+            "started_at": self.started_at.isoformat(),
+            "duration_seconds": round(time.monotonic() - self.started, 6),
+            "stages": stages,
+            "counters": counters,
+        })
+        return records
+
+    def prometheus(self, status):
+        """
+        Prometheus text exposition of the run totals. Per-station values are left to
+        the JSON lines to keep the number of series small.
+        """
+        def series(name, value, **labels):
+            # "job" is the scrape target label set by Prometheus, so use our own
+            labels = {"ingestion_job": self.job, **self.labels, **labels}
+            label_text = ",".join(f'{key}="{escape_label(value)}"' for key, value in labels.items())
+            return f"{METRIC_PREFIX}_{name}{{{label_text}}} {value}"
+
+        stages, counters = self.totals()
+        lines = [
+            f"# HELP {METRIC_PREFIX}_run_duration_seconds Wall time of the last run",
+            f"# TYPE {METRIC_PREFIX}_run_duration_seconds gauge",
+            series("run_duration_seconds", round(time.monotonic() - self.started, 6)),
+            f"# HELP {METRIC_PREFIX}_run_success Whether the last run succeeded",
+            f"# TYPE {METRIC_PREFIX}_run_success gauge",
+            series("run_success", int(status == "succeeded")),
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start of the last run",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            series("last_run_timestamp_seconds", round(self.started_at.timestamp(), 3)),
+            f"# HELP {METRIC_PREFIX}_stage_seconds Time spent per stage in the last run, summed across threads",
+            f"# TYPE {METRIC_PREFIX}_stage_seconds gauge",
+            *(series("stage_seconds", values["seconds"], stage=stage) for stage, values in sorted(stages.items())),
+            f"# HELP {METRIC_PREFIX}_stage_calls Number of times each stage ran in the last run",
+            f"# TYPE {METRIC_PREFIX}_stage_calls gauge",
+            *(series("stage_calls", values["calls"], stage=stage) for stage, values in sorted(stages.items())),
+        ]
+        for name, value in sorted(counters.items()):
+            lines += [
+                f"# TYPE {METRIC_PREFIX}_{name} gauge",
+                series(name, value),
+            ]
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        stages, counters = self.totals()
+        stage_text = ", ".join(
+            f"{stage} {values['seconds']:.2f}s/{values['calls']}" for stage, values in sorted(stages.items())
+        )
+        counter_text = ", ".join(f"{name} {value}" for name, value in sorted(counters.items()))
+        return (
+            f"{self.job} metrics: {time.monotonic() - self.started:.2f}s total; "
+            f"stages: {stage_text or 'none'}; counters: {counter_text or 'none'}"
+        )
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def write_jsonl(path, records):
+    lines = "".join(json.dumps(record, default=str) + "\n" for record in records)
+    if path == "-":
+        print(lines, end="", flush=True)
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a") as f:
+        f.write(lines)
+
+def write_textfile(directory, name, text):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.prom")
+    # node_exporter may read the file at any moment, so replace it atomically
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+# The run being recorded by this process, its static labels and the station the
+# current thread is working on
+_active = None
+_labels = {}
+_local = threading.local()
+
+def set_labels(**labels):
+    """
+    Add labels to every run recorded by this process, e.g. the shard it runs.
+    """
+    _labels.update({key: str(value) for key, value in labels.items()})
+
+def emit(metrics, status="running", jsonl_path=METRICS_JSONL_PATH, textfile_dir=METRICS_TEXTFILE_DIR):
+    """
+    Write the metrics gathered so far to the configured outputs.
+    """
+    try:
+        if jsonl_path:
+            write_jsonl(jsonl_path, metrics.records(status))
+        if textfile_dir:
+            name = "_".join([metrics.job, *(value.replace("/", "_") for value in metrics.labels.values())])
+            write_textfile(textfile_dir, name, metrics.prometheus(status))
+    except OSError as e:
+        print(f"Could not write metrics. Error: {e}")
+
+def checkpoint():
+    """
+    Write what the active run has gathered so far, e.g. after every flush of a daemon.
+    """
+    if _active is not None:
+        emit(_active)
+
+@contextmanager
+def run(job, jsonl_path=METRICS_JSONL_PATH, textfile_dir=METRICS_TEXTFILE_DIR):
+    """
+    Record the metrics of an ingestion run. When the run ends they are printed as a
+    one-line summary and written as JSON lines and a Prometheus textfile if configured.
+    """
+    global _active
+    metrics = RunMetrics(job, _labels)
+    previous, _active = _active, metrics
+    status = "failed"
+    try:
+        yield metrics
+        status = "succeeded"
+    finally:
+        _active = previous
+        print(metrics.summary())
+        emit(metrics, status, jsonl_path, textfile_dir)
+
+@contextmanager
+def station(eva_number):
+    """
+    Attribute the stages and counters of the current thread to a station.
+    """
+    previous = getattr(_local, "station", None)
+    _local.station = eva_number
+    try:
+        yield
+    finally:
+        _local.station = previous
+
+@contextmanager
+def stage(name):
+    """
+    Time a stage of the active run, attributed to the current thread's station.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if _active is not None:
+            _active.record(getattr(_local, "station", None), name, time.perf_counter() - started)
+
+def count(name, value=1):
+    """
+    Add to a counter of the active run, attributed to the current thread's station.
+    """
+    if _active is not None:
+        _active.add(getattr(_local, "station", None), name, value)
+
+def counted(items, name):
+    """
+    Yield the items while counting them under `name`.
+    """
+    total = 0
+    try:
+        for item in items:
+            total += 1
+            yield item
+    finally:
+        count(name, total)
+
+def add_profile_argument(parser, help="write cProfile stats of the main thread to this file"):
+    """
+    Add the --profile option of the ingestion entry points, passed to profile().
+    """
+    parser.add_argument("--profile", metavar="PATH", help=help)
+
+@contextmanager
+def profile(path):
+    """
+    Profile the calling thread with cProfile and dump the stats to `path`, for
+    `python -m pstats` or snakeviz. Does nothing without a path.
+    """
+    if not path:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        print(f"Profile written to {path}")
@@ -0,0 +1,3 @@
+-- Supports the set-based UPDATE ... FROM join in update_timetables.update_db
+CREATE INDEX IF NOT EXISTS raw_timetable_eva_service_idx
+    ON raw_timetable (eva_number, service_id);
@@ -0,0 +1,8 @@
+-- Plan slices (station, hour) already loaded by fetch_timetables, so they are never fetched twice
+CREATE TABLE IF NOT EXISTS loaded_plan_slices (
+    eva_number TEXT NOT NULL,
+    slice_start TIMESTAMP NOT NULL,
+    stops INTEGER NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (eva_number, slice_start)
+);
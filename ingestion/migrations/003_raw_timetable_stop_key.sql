@@ -0,0 +1,52 @@
+-- Compact 64-bit stop key replacing the ten-column uniqueness contract.
+-- The expression must stay in sync with ingestion.utils.stop_key.
+ALTER TABLE raw_timetable ADD COLUMN IF NOT EXISTS stop_key BIGINT;
+
+UPDATE raw_timetable
+SET stop_key = ('x' || substr(md5(concat_ws(chr(31),
+        coalesce(eva_number, ''),
+        coalesce(service_id, ''),
+        coalesce(train_category, ''),
+        coalesce(train_number, ''),
+        coalesce(train_operator, ''),
+        coalesce(platform, ''),
+        coalesce(route_before_arrival, ''),
+        coalesce(route_after_departure, ''),
+        coalesce(to_char(planned_arrival_time, 'YYMMDDHH24MI'), ''),
+        coalesce(to_char(planned_departure_time, 'YYMMDDHH24MI'), '')
+    )), 1, 16))::bit(64)::bigint
+WHERE stop_key IS NULL;
+
+-- NULLs never conflicted under the old constraint, so duplicates may exist.
+-- Keep one row per stop, preferring rows that already carry actual times.
+DELETE FROM raw_timetable t
+USING (
+    SELECT ctid, row_number() OVER (
+        PARTITION BY stop_key
+        ORDER BY (actual_arrival_time IS NULL AND actual_departure_time IS NULL), ctid
+    ) AS rn
+    FROM raw_timetable
+) d
+WHERE t.ctid = d.ctid AND d.rn > 1;
+
+ALTER TABLE raw_timetable ALTER COLUMN stop_key SET NOT NULL;
+CREATE UNIQUE INDEX IF NOT EXISTS raw_timetable_stop_key_idx ON raw_timetable (stop_key);
+
+-- Drop the wide ten-column unique constraint (or index) it replaces
+DO $$
+DECLARE
+    wide record;
+BEGIN
+    FOR wide IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'raw_timetable'::regclass AND contype = 'u' AND array_length(conkey, 1) = 10
+    LOOP
+        EXECUTE format('ALTER TABLE raw_timetable DROP CONSTRAINT %I', wide.conname);
+    END LOOP;
+    FOR wide IN
+        SELECT indexrelid::regclass AS index_name FROM pg_index
+        WHERE indrelid = 'raw_timetable'::regclass AND indisunique AND indnatts = 10
+    LOOP
+        EXECUTE format('DROP INDEX %s', wide.index_name);
+    END LOOP;
+END $$;
@@ -0,0 +1,97 @@
+-- Range-partition raw_timetable by planned date (one partition per day).
+-- Rows without any planned time land in the default partition.
+-- New partitions are created ahead of time and old ones archived by ingestion.partitions.
+
+-- Views on raw_timetable, such as dbt's stg_timetables, and views on those would keep
+-- pointing at the old table and block dropping it. Save their definitions (which
+-- name raw_timetable until it is renamed), drop them and recreate them at the end.
+CREATE TEMP TABLE raw_timetable_dependent_views ON COMMIT DROP AS
+WITH RECURSIVE dependents AS (
+    SELECT DISTINCT r.ev_class AS oid
+    FROM pg_depend d
+    JOIN pg_rewrite r ON r.oid = d.objid
+    WHERE d.classid = 'pg_rewrite'::regclass
+      AND d.refobjid = 'raw_timetable'::regclass
+      AND r.ev_class <> 'raw_timetable'::regclass
+    UNION
+    SELECT r.ev_class
+    FROM dependents p
+    JOIN pg_depend d ON d.refobjid = p.oid AND d.classid = 'pg_rewrite'::regclass
+    JOIN pg_rewrite r ON r.oid = d.objid
+    WHERE r.ev_class <> p.oid
+)
+SELECT c.oid, c.oid::regclass::text AS view_name, c.relkind, pg_get_viewdef(c.oid) AS definition
+FROM dependents p
+JOIN pg_class c ON c.oid = p.oid;
+
+DO $$
+DECLARE
+    dependent record;
+BEGIN
+    FOR dependent IN SELECT * FROM raw_timetable_dependent_views ORDER BY oid DESC LOOP
+        EXECUTE format(
+            'DROP %s IF EXISTS %s CASCADE',
+            CASE dependent.relkind WHEN 'm' THEN 'MATERIALIZED VIEW' ELSE 'VIEW' END,
+            dependent.view_name
+        );
+    END LOOP;
+END $$;
+
+ALTER TABLE raw_timetable RENAME TO raw_timetable_unpartitioned;
+ALTER INDEX raw_timetable_stop_key_idx RENAME TO raw_timetable_unpartitioned_stop_key_idx;
+ALTER INDEX raw_timetable_eva_service_idx RENAME TO raw_timetable_unpartitioned_eva_service_idx;
+ALTER SEQUENCE IF EXISTS raw_timetable_id_seq OWNED BY NONE;
+
+CREATE TABLE raw_timetable (
+    LIKE raw_timetable_unpartitioned INCLUDING DEFAULTS,
+    planned_date DATE
+) PARTITION BY RANGE (planned_date);
+
+CREATE UNIQUE INDEX raw_timetable_stop_key_idx ON raw_timetable (stop_key, planned_date);
+CREATE INDEX raw_timetable_eva_service_idx ON raw_timetable (eva_number, service_id);
+
+CREATE TABLE raw_timetable_default PARTITION OF raw_timetable DEFAULT;
+
+DO $$
+DECLARE
+    day DATE;
+BEGIN
+    SELECT coalesce(min(coalesce(planned_arrival_time, planned_departure_time))::date, current_date)
+    INTO day FROM raw_timetable_unpartitioned;
+    WHILE day <= current_date + 7 LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF raw_timetable FOR VALUES FROM (%L) TO (%L)',
+            'raw_timetable_p' || to_char(day, 'YYYYMMDD'), day, day + 1
+        );
+        day := day + 1;
+    END LOOP;
+END $$;
+
+INSERT INTO raw_timetable
+SELECT u.*, coalesce(u.planned_arrival_time, u.planned_departure_time)::date
+FROM raw_timetable_unpartitioned u;
+
+DROP TABLE raw_timetable_unpartitioned;
+
+-- Recreate the saved views on the partitioned table, oldest first so views on views
+-- find what they select from
+DO $$
+DECLARE
+    dependent record;
+BEGIN
+    FOR dependent IN SELECT * FROM raw_timetable_dependent_views ORDER BY oid LOOP
+        EXECUTE format(
+            'CREATE %s %s AS %s',
+            CASE dependent.relkind WHEN 'm' THEN 'MATERIALIZED VIEW' ELSE 'VIEW' END,
+            dependent.view_name,
+            rtrim(dependent.definition, ';')
+        );
+    END LOOP;
+END $$;
+
+DO $$
+BEGIN
+    IF to_regclass('raw_timetable_id_seq') IS NOT NULL THEN
+        ALTER SEQUENCE raw_timetable_id_seq OWNED BY raw_timetable.id;
+    END IF;
+END $$;
@@ -0,0 +1,4 @@
+-- Ingestion-modified timestamp used as the watermark of the incremental dbt models.
+-- Set on insert and bumped by update_timetables whenever actual times change.
+ALTER TABLE raw_timetable ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT now();
+CREATE INDEX IF NOT EXISTS raw_timetable_updated_at_idx ON raw_timetable (updated_at);
@@ -0,0 +1,12 @@
+-- Arrival and departure delays in seconds, computed once when actual times are
+-- written instead of on every read of stg_timetables. NULL while a stop has no
+-- actual time yet.
+ALTER TABLE raw_timetable
+    ADD COLUMN IF NOT EXISTS arrival_delay_seconds INTEGER
+        GENERATED ALWAYS AS (extract(epoch FROM actual_arrival_time - planned_arrival_time)::integer) STORED,
+    ADD COLUMN IF NOT EXISTS departure_delay_seconds INTEGER
+        GENERATED ALWAYS AS (extract(epoch FROM actual_departure_time - planned_departure_time)::integer) STORED;
+
+-- Only stops with a delay are read by the dbt models
+CREATE INDEX IF NOT EXISTS raw_timetable_delayed_idx ON raw_timetable (planned_date)
+    WHERE arrival_delay_seconds IS NOT NULL OR departure_delay_seconds IS NOT NULL;
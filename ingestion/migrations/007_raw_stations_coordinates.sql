@@ -0,0 +1,20 @@
+-- Store station coordinates as numbers and key raw_stations by StaDa station number
+-- so ingestion.fetch_stations can sync the catalog incrementally.
+ALTER TABLE raw_stations
+    ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION;
+
+-- cordinates holds "(lon, lat)"
+UPDATE raw_stations
+SET longitude = nullif(trim(split_part(trim(both '()' FROM cordinates), ',', 1)), '')::double precision,
+    latitude = nullif(trim(split_part(trim(both '()' FROM cordinates), ',', 2)), '')::double precision
+WHERE cordinates IS NOT NULL;
+
+ALTER TABLE raw_stations DROP COLUMN cordinates;
+
+-- Earlier runs of fetch_stations could insert a station twice; keep one row per number
+DELETE FROM raw_stations s
+USING raw_stations d
+WHERE s.id = d.id AND s.ctid > d.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS raw_stations_id_idx ON raw_stations (id);
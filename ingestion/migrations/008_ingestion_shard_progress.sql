@@ -0,0 +1,14 @@
+-- Progress of each shard of a sharded ingestion run, written by ingestion.scheduler
+CREATE TABLE IF NOT EXISTS ingestion_shard_progress (
+    job TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    shards INTEGER NOT NULL,
+    stations INTEGER NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    done INTEGER NOT NULL DEFAULT 0,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ,
+    error TEXT,
+    PRIMARY KEY (job, shard)
+);
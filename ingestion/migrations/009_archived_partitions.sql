@@ -0,0 +1,9 @@
+-- raw_timetable partitions exported and dropped by ingestion.partitions, so a full
+-- dbt refresh can tell that the history it would rebuild from is incomplete
+CREATE TABLE IF NOT EXISTS archived_partitions (
+    name TEXT PRIMARY KEY,
+    day DATE NOT NULL,
+    row_count BIGINT NOT NULL,
+    path TEXT NOT NULL,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
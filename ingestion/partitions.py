@@ -0,0 +1,197 @@
+import argparse
+import csv
+import gzip
+import os
+from datetime import date, datetime, timedelta
+
+import psycopg
+from dotenv import load_dotenv
+from psycopg import sql
+
+from . import metrics
+
+load_dotenv()
+
+conn_string = os.getenv('DATABASE_URL')
+
+# Daily raw_timetable partitions kept ahead of today and kept in the database
+PARTITION_DAYS_AHEAD = int(os.getenv('PARTITION_DAYS_AHEAD', '7'))
+PARTITION_RETENTION_DAYS = int(os.getenv('PARTITION_RETENTION_DAYS', '90'))
+PARTITION_ARCHIVE_DIR = os.getenv('PARTITION_ARCHIVE_DIR', 'archive')
+
+PARTITION_PREFIX = "raw_timetable_p"
+
+def partition_name(day):
+    return PARTITION_PREFIX + day.strftime('%Y%m%d')
+
+def ensure_partitions(conn, days):
+    """
+    Create the daily raw_timetable partitions for the given dates if missing.
+    """
+    with conn.cursor() as cur:
+        for day in sorted(set(days)):
+            # DDL takes no bind parameters, so the bounds are inlined as literals
+            cur.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {} PARTITION OF raw_timetable FOR VALUES FROM ({}) TO ({});"
+            ).format(sql.Identifier(partition_name(day)), sql.Literal(day), sql.Literal(day + timedelta(days=1))))
+    conn.commit()
+
+def list_partitions(conn):
+    """
+    Return (name, day) for every daily raw_timetable partition, oldest first.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'raw_timetable'::regclass AND c.relname LIKE %s;
+        """, (PARTITION_PREFIX + "%",))
+        names = sorted(row[0] for row in cur.fetchall())
+    conn.commit()
+    return [(name, datetime.strptime(name[len(PARTITION_PREFIX):], '%Y%m%d').date()) for name in names]
+
+def archive_path(archive_dir, name):
+    return os.path.join(archive_dir, f"{name}.csv.gz")
+
+def partition_rows(conn, name):
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("SELECT count(*) FROM {};").format(sql.Identifier(name)))
+        rows = cur.fetchone()[0]
+    conn.commit()
+    return rows
+
+def archived_rows(path):
+    """
+    Number of rows in an archive file, or None if there is none.
+    """
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", newline="") as f:
+        return sum(1 for _ in csv.reader(f)) - 1
+
+def export_partition(conn, name, archive_dir):
+    """
+    Export a partition to a gzip-compressed CSV file with a header row. Generated
+    columns are left out by COPY and computed again on restore.
+    Returns the path of the archive.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = archive_path(archive_dir, name)
+    tmp_path = path + ".tmp"
+    with conn.cursor() as cur:
+        with gzip.open(tmp_path, "wb") as f:
+            with cur.copy(sql.SQL("COPY {} TO STDOUT (FORMAT csv, HEADER);").format(sql.Identifier(name))) as copy:
+                for data in copy:
+                    f.write(data)
+    conn.commit()
+    os.replace(tmp_path, path)
+    return path
+
+def drop_partition(conn, name, day, path):
+    """
+    Detach and drop a partition whose archive holds all of its rows, and record it
+    in archived_partitions. Returns False, keeping the partition, otherwise.
+    """
+    rows = partition_rows(conn, name)
+    if archived_rows(path) != rows:
+        return False
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("ALTER TABLE raw_timetable DETACH PARTITION {};").format(sql.Identifier(name)))
+        cur.execute(sql.SQL("DROP TABLE {};").format(sql.Identifier(name)))
+        cur.execute("""
+            INSERT INTO archived_partitions (name, day, row_count, path)
+            VALUES (%s, %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE
+            SET row_count = EXCLUDED.row_count, path = EXCLUDED.path, archived_at = now();
+        """, (name, day, rows, path))
+    conn.commit()
+    return True
+
+def restore_partition(conn, day, archive_dir):
+    """
+    Load an archived partition back into raw_timetable, e.g. before a full dbt
+    refresh. Returns the number of rows restored.
+    """
+    name = partition_name(day)
+    path = archive_path(archive_dir, name)
+    with gzip.open(path, "rt", newline="") as f:
+        columns = next(csv.reader(f))
+    ensure_partitions(conn, [day])
+    with conn.cursor() as cur:
+        with gzip.open(path, "rb") as f:
+            with cur.copy(sql.SQL("COPY {} ({}) FROM STDIN (FORMAT csv, HEADER);").format(
+                sql.Identifier(name), sql.SQL(", ").join(map(sql.Identifier, columns))
+            )) as copy:
+                while data := f.read(1 << 16):
+                    copy.write(data)
+        rows = cur.rowcount
+        cur.execute("DELETE FROM archived_partitions WHERE name = %s;", (name,))
+    conn.commit()
+    return rows
+
+@metrics.run("maintain_partitions")
+def main(days_ahead=PARTITION_DAYS_AHEAD, retention_days=PARTITION_RETENTION_DAYS, archive_dir=PARTITION_ARCHIVE_DIR,
+         export=True, drop=True):
+    """
+    Create the upcoming partitions and archive the ones past the retention period.
+    An old partition is exported unless its archive already holds all of its rows,
+    and only dropped once it does, so the export can be copied to durable storage
+    between a run with `drop` off and one with `export` off.
+    """
+    conn = psycopg.connect(conn_string)
+    today = date.today()
+
+    with metrics.stage("db_partitions"):
+        ensure_partitions(conn, [today + timedelta(days=i) for i in range(-1, days_ahead + 1)])
+
+    cutoff = today - timedelta(days=retention_days)
+    for name, day in list_partitions(conn):
+        if day >= cutoff:
+            continue
+        path = archive_path(archive_dir, name)
+        if export and archived_rows(path) != partition_rows(conn, name):
+            with metrics.stage("archive"):
+                export_partition(conn, name, archive_dir)
+            metrics.count("partitions_exported")
+            print(f"Exported partition {name} to {path}")
+        if not drop:
+            continue
+        with metrics.stage("drop"):
+            dropped = drop_partition(conn, name, day, path)
+        if dropped:
+            metrics.count("partitions_archived")
+            print(f"Archived partition {name} to {path}")
+        else:
+            print(f"Kept partition {name}: {path} does not hold all of its rows")
+
+    conn.close()
+
+def restore(day, archive_dir=PARTITION_ARCHIVE_DIR):
+    with psycopg.connect(conn_string) as conn:
+        rows = restore_partition(conn, day, archive_dir)
+    print(f"Restored {rows} rows of {partition_name(day)} from {archive_dir}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Create upcoming raw_timetable partitions and archive old ones.")
+    parser.add_argument("--days-ahead", type=int, default=PARTITION_DAYS_AHEAD,
+                        help="number of daily partitions to create ahead of today")
+    parser.add_argument("--retention-days", type=int, default=PARTITION_RETENTION_DAYS,
+                        help="partitions older than this many days are archived and dropped")
+    parser.add_argument("--archive-dir", default=PARTITION_ARCHIVE_DIR,
+                        help="directory receiving the compressed partition exports")
+    parser.add_argument("--no-drop", action="store_true",
+                        help="only export the old partitions, keeping them in the database")
+    parser.add_argument("--no-export", action="store_true",
+                        help="only drop the old partitions whose archive holds all of their rows")
+    parser.add_argument("--restore", metavar="YYYY-MM-DD", type=date.fromisoformat,
+                        help="load the archived partition of this day back into raw_timetable and exit")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.restore:
+        restore(args.restore, args.archive_dir)
+    else:
+        with metrics.profile(args.profile):
+            main(args.days_ahead, args.retention_days, args.archive_dir, not args.no_export, not args.no_drop)
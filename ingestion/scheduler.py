@@ -0,0 +1,271 @@
+import argparse
+import hashlib
+import multiprocessing
+import os
+import time
+
+import psycopg
+from dotenv import load_dotenv
+
+from . import fetch_timetables, metrics, update_timetables
+from .http_client import SCHEDULER_REQUESTS_PER_MINUTE
+from .station_cache import Station
+
+load_dotenv()
+
+conn_string = os.getenv('DATABASE_URL')
+
+# Stations scheduled by default: every raw_stations name matching this LIKE pattern
+STATION_NAME_PATTERN = os.getenv('SCHEDULER_STATION_PATTERN', '% Hbf%')
+
+# Number of shards the stations are split into, each run by its own process or runner
+SCHEDULER_SHARDS = int(os.getenv('SCHEDULER_SHARDS', '4'))
+
+# Train volume of a station is the number of planned stops loaded over this many days
+VOLUME_DAYS = int(os.getenv('SCHEDULER_VOLUME_DAYS', '7'))
+
+# Seconds between two progress writes of a shard and two progress tables printed
+PROGRESS_INTERVAL_SECONDS = float(os.getenv('SCHEDULER_PROGRESS_INTERVAL', '10'))
+
+JOBS = ("plan", "changes")
+
+def select_stations(conn, pattern=STATION_NAME_PATTERN, federal_state=None, limit=None, volume_days=VOLUME_DAYS):
+    """
+    Return [(Station, volume)] for the raw_stations matching the filter, busiest
+    first. The volume of a station is the number of planned stops loaded for it over
+    the last `volume_days` days; stations never loaded come last. With `limit`
+    only the busiest stations are kept.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT s.name, s.eva_number, s.latitude, s.longitude, coalesce(v.stops, 0) AS volume
+            FROM raw_stations s
+            LEFT JOIN (
+                SELECT eva_number, sum(stops) AS stops
+                FROM loaded_plan_slices
+                WHERE slice_start >= localtimestamp - make_interval(days => %(days)s)
+                GROUP BY eva_number
+            ) v ON v.eva_number = s.eva_number::text
+            WHERE s.eva_number IS NOT NULL
+              AND s.name LIKE %(pattern)s
+              AND (%(state)s::text IS NULL OR s.federal_state = %(state)s)
+            ORDER BY volume DESC, s.name
+            LIMIT %(limit)s;
+        """, {"days": volume_days, "pattern": pattern, "state": federal_state, "limit": limit})
+        rows = cur.fetchall()
+    conn.commit()
+    return [(Station(*row[:4]), row[4]) for row in rows]
+
+def shard_of(eva_number, shards):
+    """
+    Stable shard of a station: the same EVA number lands in the same shard on every
+    runner, unlike Python's per-process randomized hash().
+    """
+    digest = hashlib.md5(str(eva_number).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards
+
+def shard_stations(stations, shard, shards):
+    """
+    Keep the stations of one shard, preserving their order.
+    """
+    return [station for station in stations if shard_of(station.eva_number, shards) == shard]
+
+class ShardProgress:
+    """
+    Record the progress of one shard in ingestion_shard_progress. Called as
+    progress(done, total) by the jobs; writes at most every `interval` seconds.
+    """
+    def __init__(self, conn, job, shard, shards, stations, interval=PROGRESS_INTERVAL_SECONDS):
+        self.conn = conn
+        self.key = {"job": job, "shard": shard}
+        self.interval = interval
+        self.written = time.monotonic()
+        with conn.cursor() as cur:
+            # Rows of an earlier run with a different shard count are stale
+            cur.execute(
+                "DELETE FROM ingestion_shard_progress WHERE job = %s AND shards <> %s;",
+                (job, shards),
+            )
+            cur.execute("""
+                INSERT INTO ingestion_shard_progress (job, shard, shards, stations)
+                VALUES (%(job)s, %(shard)s, %(shards)s, %(stations)s)
+                ON CONFLICT (job, shard) DO UPDATE
+                SET shards = EXCLUDED.shards, stations = EXCLUDED.stations, total = 0, done = 0,
+                    started_at = now(), updated_at = now(), finished_at = NULL, error = NULL;
+            """, {**self.key, "shards": shards, "stations": stations})
+        conn.commit()
+
+    def __call__(self, done, total):
+        if done < total and time.monotonic() - self.written < self.interval:
+            return
+        self.write(done, total)
+
+    def write(self, done, total):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ingestion_shard_progress
+                SET done = %(done)s, total = %(total)s, updated_at = now()
+                WHERE job = %(job)s AND shard = %(shard)s;
+            """, {**self.key, "done": done, "total": total})
+        self.conn.commit()
+        self.written = time.monotonic()
+
+    def finish(self, error=None):
+        with self.conn.cursor() as cur:
+            cur.execute("""
+                UPDATE ingestion_shard_progress
+                SET updated_at = now(), finished_at = now(), error = %(error)s
+                WHERE job = %(job)s AND shard = %(shard)s;
+            """, {**self.key, "error": error})
+        self.conn.commit()
+
+def run_shard(job, shard, shards, stations, requests_per_minute, hours=fetch_timetables.PREFETCH_HOURS, force=False):
+    """
+    Run `job` for the stations of one shard with its share of the API quota,
+    recording its progress.
+    """
+    print(f"Shard {shard}/{shards}: {len(stations)} stations, {requests_per_minute:.1f} requests per minute")
+    metrics.set_labels(shard=f"{shard}/{shards}")
+    with psycopg.connect(conn_string) as conn:
+        progress = ShardProgress(conn, job, shard, shards, len(stations))
+        try:
+            if job == "plan":
+                fetch_timetables.main(hours, force, stations, requests_per_minute, progress)
+            else:
+                update_timetables.main(stations, requests_per_minute, progress, shard_state_path(shard, shards))
+        except Exception as e:
+            progress.finish(str(e))
+            raise
+        progress.finish()
+
+def shard_state_path(shard, shards, path=update_timetables.CHANGE_STATE_PATH):
+    """
+    Change state file of one shard, so concurrent shards never overwrite each other.
+    """
+    if not path:
+        return None
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{shard}of{shards}{ext}"
+
+def shard_progress(conn, job):
+    """
+    Return the progress rows of every shard of `job`.
+    """
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT shard, shards, stations, done, total,
+                   extract(epoch FROM coalesce(finished_at, now()) - started_at),
+                   finished_at IS NOT NULL, error
+            FROM ingestion_shard_progress
+            WHERE job = %s
+            ORDER BY shard;
+        """, (job,))
+        rows = cur.fetchall()
+    conn.commit()
+    return rows
+
+def format_progress(rows):
+    lines = [f"{'shard':>7} {'stations':>8} {'done':>13} {'elapsed':>8} {'eta':>8}  status"]
+    for shard, shards, stations, done, total, elapsed, finished, error in rows:
+        elapsed = float(elapsed)
+        if error:
+            status = f"failed: {error.splitlines()[0]}"
+        elif finished:
+            status = "finished"
+        else:
+            status = "running"
+        eta = "-"
+        if not finished and 0 < done < total:
+            eta = f"{elapsed / done * (total - done):.0f}s"
+        lines.append(
+            f"{shard:>3}/{shards:<3} {stations:>8} {done:>6}/{total:<6} {elapsed:>7.0f}s {eta:>8}  {status}"
+        )
+    return "\n".join(lines)
+
+def print_progress(job):
+    with psycopg.connect(conn_string) as conn:
+        print(format_progress(shard_progress(conn, job)), flush=True)
+
+def main(job="plan", shards=SCHEDULER_SHARDS, shard=None, pattern=STATION_NAME_PATTERN, federal_state=None,
+         limit=None, hours=fetch_timetables.PREFETCH_HOURS, force=False, requests_per_minute=SCHEDULER_REQUESTS_PER_MINUTE):
+    """
+    Split the selected stations into `shards` shards by EVA number and run `job`
+    for each shard, busiest stations first, giving every shard an equal share of
+    `requests_per_minute`, the part of the API quota left by the jobs running
+    alongside. Runs a single shard when `shard` is given, e.g. one per CI
+    runner; otherwise starts one process per shard and prints their progress.
+    """
+    if shard is not None and not 0 <= shard < shards:
+        raise ValueError(f"Shard {shard} is not one of the {shards} shards")
+    if requests_per_minute < shards:
+        raise ValueError(f"A quota of {requests_per_minute} requests per minute cannot be split across {shards} shards")
+
+    with psycopg.connect(conn_string) as conn:
+        selected = select_stations(conn, pattern, federal_state, limit)
+    stations = [station for station, _ in selected]
+    share = requests_per_minute / shards
+    print(
+        f"Scheduling {job} for {len(stations)} stations "
+        f"({sum(volume for _, volume in selected)} stops over {VOLUME_DAYS} days) across {shards} shards"
+    )
+
+    if shard is not None:
+        run_shard(job, shard, shards, shard_stations(stations, shard, shards), share, hours, force)
+        return
+
+    processes = [
+        multiprocessing.Process(
+            target=run_shard,
+            args=(job, i, shards, shard_stations(stations, i, shards), share, hours, force),
+            name=f"{job}-shard-{i}",
+        )
+        for i in range(shards)
+    ]
+    for process in processes:
+        process.start()
+    while any(process.is_alive() for process in processes):
+        time.sleep(PROGRESS_INTERVAL_SECONDS)
+        print_progress(job)
+    for process in processes:
+        process.join()
+    print_progress(job)
+
+    failed = [process.name for process in processes if process.exitcode != 0]
+    if failed:
+        raise SystemExit(f"Failed shards: {', '.join(failed)}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run an ingestion job for many stations, sharded by EVA number.")
+    parser.add_argument("job", choices=JOBS,
+                        help="plan loads planned timetables, changes applies the full changes")
+    parser.add_argument("--shards", type=int, default=SCHEDULER_SHARDS,
+                        help="number of shards the stations are split into")
+    parser.add_argument("--shard", type=int, default=None,
+                        help="run only this shard (0-based) in the current process, e.g. on one of several runners")
+    parser.add_argument("--pattern", default=STATION_NAME_PATTERN,
+                        help="LIKE pattern selecting stations by name")
+    parser.add_argument("--federal-state", default=None,
+                        help="only schedule stations of this federal state")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="only schedule this many of the busiest stations")
+    parser.add_argument("--hours", type=int, default=fetch_timetables.PREFETCH_HOURS,
+                        help="number of hourly plan slices to fetch per station (plan job)")
+    parser.add_argument("--force", action="store_true",
+                        help="fetch slices again even if they were already loaded (plan job)")
+    parser.add_argument("--requests-per-minute", type=int, default=SCHEDULER_REQUESTS_PER_MINUTE,
+                        help="share of the API quota split across all shards")
+    parser.add_argument("--status", action="store_true",
+                        help="print the progress of the last run of the job and exit")
+    metrics.add_profile_argument(
+        parser, help="write cProfile stats of this process to this file; shard processes are not profiled"
+    )
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.status:
+        print_progress(args.job)
+    else:
+        with metrics.profile(args.profile):
+            main(args.job, args.shards, args.shard, args.pattern, args.federal_state,
+                 args.limit, args.hours, args.force, args.requests_per_minute)
@@ -0,0 +1,69 @@
+import argparse
+import os
+from pathlib import Path
+
+import psycopg
+from dotenv import load_dotenv
+
+from . import metrics
+
+load_dotenv()
+
+conn_string = os.getenv('DATABASE_URL')
+
+MIGRATIONS_DIR = Path(__file__).parent / "migrations"
+
+# Advisory lock held while migrating, as every workflow applies migrations first
+MIGRATIONS_LOCK_ID = 4242001
+
+def applied_migrations(conn):
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_ID,))
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                name TEXT PRIMARY KEY,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        cur.execute("SELECT name FROM schema_migrations;")
+        return {row[0] for row in cur.fetchall()}
+
+def apply_migrations(conn):
+    """
+    Apply every migration in ingestion/migrations that has not been applied yet,
+    in file name order. Each migration runs in its own transaction. Concurrent
+    callers wait for each other, so every migration is applied once.
+    """
+    done = applied_migrations(conn)
+    conn.commit()
+    for path in sorted(MIGRATIONS_DIR.glob("*.sql")):
+        if path.name in done:
+            continue
+        with conn.cursor() as cur:
+            # Transaction-level lock, which also holds behind a transaction-mode pooler
+            cur.execute("SELECT pg_advisory_xact_lock(%s);", (MIGRATIONS_LOCK_ID,))
+            cur.execute("SELECT 1 FROM schema_migrations WHERE name = %s;", (path.name,))
+            if cur.fetchone():
+                conn.commit()
+                continue
+            cur.execute(path.read_text())
+            cur.execute("INSERT INTO schema_migrations (name) VALUES (%s);", (path.name,))
+        conn.commit()
+        metrics.count("migrations_applied")
+        print(f"Applied migration {path.name}")
+
+@metrics.run("setup_db")
+def main():
+    conn = psycopg.connect(conn_string)
+    apply_migrations(conn)
+    conn.close()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply pending database migrations.")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    with metrics.profile(args.profile):
+        main()
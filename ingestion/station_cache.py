@@ -0,0 +1,71 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+from .utils import STATION_NAMES
+
+# Local copy of the station metadata shared by all ingestion jobs
+STATION_CACHE_PATH = os.getenv(
+    'STATION_CACHE_PATH',
+    os.path.join(os.path.expanduser("~"), ".cache", "deutschebahnalytics", "stations.json"),
+)
+STATION_CACHE_TTL_SECONDS = int(os.getenv('STATION_CACHE_TTL', str(24 * 60 * 60)))
+
+Station = namedtuple("Station", ["name", "eva_number", "latitude", "longitude"])
+
+def fetch_station_metadata(conn, names):
+    """
+    Look up name, EVA number and coordinates of all given stations with one query.
+    """
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT name, eva_number, latitude, longitude FROM raw_stations WHERE name = ANY(%s);",
+            (list(names),),
+        )
+        rows = cur.fetchall()
+    conn.commit()
+    return {row[0]: Station(*row) for row in rows}
+
+def read_cache(path, ttl):
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+        if time.time() - cache["fetched_at"] > ttl:
+            return None
+        stations = {name: Station(*fields) for name, fields in cache["stations"].items()}
+        return stations, set(cache["missing"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def write_cache(path, stations, missing):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "fetched_at": time.time(),
+            "stations": {name: list(station) for name, station in stations.items()},
+            "missing": sorted(missing),
+        }, f)
+    os.replace(tmp_path, path)
+
+def load_stations(conn, names=STATION_NAMES, path=STATION_CACHE_PATH, ttl=STATION_CACHE_TTL_SECONDS):
+    """
+    Return {name: Station} for the given station names, in the given order.
+    Served from the local cache while it is younger than `ttl` seconds and knows
+    every name; otherwise refreshed with a single bulk query.
+    """
+    cached = read_cache(path, ttl)
+    if cached is not None and all(name in cached[0] or name in cached[1] for name in names):
+        stations = cached[0]
+    else:
+        stations = fetch_station_metadata(conn, names)
+        missing = set(names) - set(stations)
+        for name in sorted(missing):
+            print(f"Station {name} not found in raw_stations")
+        try:
+            write_cache(path, stations, missing)
+        except OSError as e:
+            print(f"Could not write station cache {path}. Error: {e}")
+
+    return {name: stations[name] for name in names if name in stations}
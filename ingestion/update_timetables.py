@@ -1,58 +1,256 @@
+import argparse
+import heapq
 import requests
 import psycopg
+import signal
+import threading
+import time
+import xml.etree.ElementTree as ET
 from dotenv import load_dotenv
 import os
-from .utils import STATION_NAMES, fetch_eva_number, parse_recent_changes
+from . import metrics
+from .change_engine import ChangeEngine
+from .change_tracker import ChangeTracker
+from .http_client import DB_API_BASE_URL, UPDATE_REQUESTS_PER_MINUTE, ApiClient
+from .station_cache import load_stations
+from .utils import copy_rows, iter_recent_changes, notify_table_changes
 
 load_dotenv()
 
 conn_string = os.getenv('DATABASE_URL')
 
-DB_CLIENT_ID = os.getenv('Client_ID')
-DB_CLIENT_SECRET = os.getenv('Client_Secret')
-
-RECENT_CHANGE_API = "https://apis.deutschebahn.com/db-api-marketplace/apis/timetables/v1/rchg/"
-
-headers = {
-    "DB-Client-ID": DB_CLIENT_ID,
-    "DB-Api-Key": DB_CLIENT_SECRET,
-    "accept": "application/xml"
-}
-
-def fetch_recent_changes(eva_no):
-    response = requests.get(RECENT_CHANGE_API + str(eva_no), headers=headers)
-    if response.status_code == 200:
-        return response.text
-    else:
-        print(f"Failed for {eva_no}: {response.status_code}")
-        return None
-
-def update_db(conn, eva_number, stops):
-    cur = conn.cursor()
-    for service_id, stop in stops.items():
-        cur.execute(
-            "UPDATE raw_timetable \
-            SET actual_arrival_time = %s, actual_departure_time = %s \
-            Where (service_id = %s AND eva_number = %s)",
-            (stop["actual_arrival_time"], stop["actual_departure_time"], service_id, str(eva_number))
-        )
-        conn.commit()
-    cur.close()
-
-def main():
+RECENT_CHANGE_API = DB_API_BASE_URL + "/timetables/v1/rchg/"
+FULL_CHANGE_API = DB_API_BASE_URL + "/timetables/v1/fchg/"
+
+# Seconds between two rchg polls of the same station in daemon mode
+POLL_INTERVAL_SECONDS = float(os.getenv('RCHG_POLL_INTERVAL', '30'))
+
+# Seconds between two flushes of the merged changes to the database in daemon mode
+FLUSH_INTERVAL_SECONDS = float(os.getenv('CHANGE_FLUSH_INTERVAL', '60'))
+
+# Only raw_timetable partitions planned within this many days of today are updated
+UPDATE_WINDOW_DAYS = int(os.getenv('UPDATE_WINDOW_DAYS', '1'))
+
+# Optional JSON file persisting the last applied state between one-shot runs
+CHANGE_STATE_PATH = os.getenv('CHANGE_STATE_PATH')
+
+def fetch_recent_changes(eva_no, client):
+    return client.get(RECENT_CHANGE_API + str(eva_no), endpoint="rchg").content
+
+def fetch_full_changes(eva_no, client):
+    return client.get(FULL_CHANGE_API + str(eva_no), endpoint="fchg").content
+
+CHANGE_COLUMNS = (
+    "eva_number",
+    "service_id",
+    "actual_arrival_time",
+    "actual_departure_time",
+)
+
+def change_rows(eva_number, changes):
+    for change in changes:
+        yield (str(eva_number), *change)
+
+def update_db(conn, rows):
+    """
+    Apply a batch of recent changes in one round trip: COPY them into a temporary
+    table and update raw_timetable with a single UPDATE ... FROM join on
+    (eva_number, service_id), restricted to the partitions of the last and next
+    UPDATE_WINDOW_DAYS days. Returns the set of (eva_number, service_id) updated.
+    """
+    columns = ", ".join(CHANGE_COLUMNS)
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE raw_timetable_changes ON COMMIT DROP AS
+            SELECT {columns} FROM raw_timetable WITH NO DATA;
+        """)
+        copy_rows(cur, "raw_timetable_changes", CHANGE_COLUMNS, rows)
+        cur.execute("""
+            UPDATE raw_timetable r
+            SET actual_arrival_time = coalesce(c.actual_arrival_time, r.actual_arrival_time),
+                actual_departure_time = coalesce(c.actual_departure_time, r.actual_departure_time),
+                updated_at = CASE
+                    WHEN (r.actual_arrival_time, r.actual_departure_time) IS DISTINCT FROM (
+                        coalesce(c.actual_arrival_time, r.actual_arrival_time),
+                        coalesce(c.actual_departure_time, r.actual_departure_time)
+                    ) THEN now()
+                    ELSE r.updated_at
+                END
+            FROM raw_timetable_changes c
+            WHERE r.eva_number = c.eva_number AND r.service_id = c.service_id
+              AND r.planned_date BETWEEN current_date - %(window)s AND current_date + %(window)s
+            RETURNING r.eva_number, r.service_id;
+        """, {"window": UPDATE_WINDOW_DAYS})
+        updated = set(cur.fetchall())
+        if updated:
+            notify_table_changes(cur, "raw_timetable")
+    conn.commit()
+    return updated
+
+def poll_station(client, eva_number, engine, tracker):
+    """
+    Bring the in-memory state of one station up to date: load its fchg snapshot
+    when it has none or polls were missed, merge the rchg delta otherwise. A
+    response that cannot be parsed is skipped as a whole, like a failed request.
+    Returns a short description of what was merged.
+    """
+    with metrics.station(eva_number):
+        snapshot = engine.needs_snapshot(eva_number)
+        fetch = fetch_full_changes if snapshot else fetch_recent_changes
+        try:
+            payload = fetch(eva_number, client)
+        except requests.exceptions.RequestException as e:
+            print(f"Failed for {eva_number}: {e}")
+            return "failed"
+
+        if not snapshot and tracker.is_duplicate_payload(eva_number, payload):
+            engine.touch(eva_number)
+            metrics.count("payloads_unchanged")
+            return "rchg unchanged"
+        try:
+            with metrics.stage("parse"):
+                changes = list(metrics.counted(iter_recent_changes(payload), "stops_parsed"))
+        except (ET.ParseError, ValueError) as e:
+            print(f"Could not parse the response for {eva_number}. Error: {e}")
+            metrics.count("parse_errors")
+            return "failed"
+
+        if snapshot:
+            engine.load_snapshot(eva_number, changes)
+            return "fchg snapshot loaded"
+        engine.merge_delta(eva_number, changes)
+        return "rchg merged"
+
+def flush_changes(conn, engine, tracker):
+    """
+    Write the net changes collected by the engine in one transaction, skipping
+    stops whose times already match what was last applied.
+    """
+    rows = engine.pending_rows()
+    changed = tracker.changed_rows(rows)
+    with metrics.stage("db_write"):
+        updated = update_db(conn, changed) if changed else set()
+    metrics.count("rows_written", len(updated))
+    metrics.count("rows_skipped", len(rows) - len(changed))
+    tracker.mark_applied(changed, updated)
+    tracker.save()
+    engine.mark_flushed(rows, {(eva_number, service_id) for eva_number, service_id, _, _ in changed} - updated)
+    print(
+        f"Flushed changes: {len(rows)} pending, {len(changed)} applied, "
+        f"{len(rows) - len(changed)} skipped as unchanged, {len(updated)} rows updated"
+    )
+
+@metrics.run("update_timetables_daemon")
+def run_daemon(interval=POLL_INTERVAL_SECONDS, max_runtime=None, flush_interval=FLUSH_INTERVAL_SECONDS,
+               requests_per_minute=UPDATE_REQUESTS_PER_MINUTE):
+    """
+    Poll every station every `interval` seconds over one DB connection and one
+    HTTP session, merging the changes in memory and flushing them to the database
+    every `flush_interval` seconds, until SIGTERM/SIGINT is received or
+    `max_runtime` seconds pass. Stations are staggered across the interval to
+    spread requests evenly, and at most `requests_per_minute` requests are sent.
+    """
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        print(f"Received signal {signum}, stopping after the current poll")
+        stop.set()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
     conn = psycopg.connect(conn_string)
+    client = ApiClient("application/xml", requests_per_minute)
+    engine = ChangeEngine()
+    tracker = ChangeTracker(CHANGE_STATE_PATH)
+    with metrics.stage("station_lookup"):
+        eva_numbers = [station.eva_number for station in load_stations(conn).values()]
+
+    started = time.monotonic()
+    deadline = started + max_runtime if max_runtime else None
+    next_flush = started + flush_interval
+    schedule = [
+        (started + i * interval / len(eva_numbers), eva_number)
+        for i, eva_number in enumerate(eva_numbers)
+    ]
+    heapq.heapify(schedule)
 
-    # Iterate through each station
-    # states = fetch_states(conn)
-    for station in STATION_NAMES:
-        eva_number = fetch_eva_number(conn, station)
+    try:
+        while schedule and not stop.is_set():
+            due, eva_number = heapq.heappop(schedule)
+            if deadline is not None and due >= deadline:
+                break
+            if stop.wait(max(0.0, min(due, next_flush) - time.monotonic())):
+                break
 
-        # Fetch recent changes
-        recent_changes = fetch_recent_changes(eva_number)
-        parsed_recent_changes = parse_recent_changes(recent_changes)
-        update_db(conn, eva_number, parsed_recent_changes)
+            if due <= time.monotonic():
+                print(f"{eva_number}: {poll_station(client, eva_number, engine, tracker)}")
+                due = max(due + interval, time.monotonic())
+            heapq.heappush(schedule, (due, eva_number))
+
+            if time.monotonic() >= next_flush:
+                try:
+                    flush_changes(conn, engine, tracker)
+                except psycopg.OperationalError as e:
+                    print(f"Database error while flushing changes, reconnecting. Error: {e}")
+                    conn.close()
+                    conn = psycopg.connect(conn_string)
+                metrics.checkpoint()
+                next_flush = time.monotonic() + flush_interval
+
+    finally:
+        # Keep what was merged before an error or a stop signal
+        try:
+            flush_changes(conn, engine, tracker)
+        finally:
+            client.close()
+            conn.close()
+            print("Update daemon stopped")
+
+@metrics.run("update_timetables")
+def main(stations=None, requests_per_minute=UPDATE_REQUESTS_PER_MINUTE, progress=None, state_path=CHANGE_STATE_PATH):
+    """
+    Load the full changes of `stations` (Station records, the STATION_NAMES stations
+    by default) with at most `requests_per_minute` requests, e.g. the share of a
+    sharded run, then apply them in one transaction.
+    progress(done, total) is called after every station.
+    """
+    conn = psycopg.connect(conn_string)
+
+    if stations is None:
+        with metrics.stage("station_lookup"):
+            stations = load_stations(conn).values()
+    stations = list(stations)
+    engine = ChangeEngine()
+    tracker = ChangeTracker(state_path)
+    with ApiClient("application/xml", requests_per_minute) as client:
+        for done, station in enumerate(stations, 1):
+            print(f"{station.eva_number}: {poll_station(client, station.eva_number, engine, tracker)}")
+            if progress is not None:
+                progress(done, len(stations))
+    flush_changes(conn, engine, tracker)
 
     conn.close()
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Apply recent timetable changes to raw_timetable.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="keep polling instead of running a single pass")
+    parser.add_argument("--interval", type=float, default=POLL_INTERVAL_SECONDS,
+                        help="seconds between two polls of the same station in daemon mode")
+    parser.add_argument("--flush-interval", type=float, default=FLUSH_INTERVAL_SECONDS,
+                        help="seconds between two database flushes in daemon mode")
+    parser.add_argument("--max-runtime", type=float, default=None,
+                        help="stop the daemon after this many seconds")
+    parser.add_argument("--requests-per-minute", type=int, default=UPDATE_REQUESTS_PER_MINUTE,
+                        help="share of the API quota used by this job")
+    metrics.add_profile_argument(parser)
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    args = parse_args()
+    with metrics.profile(args.profile):
+        if args.daemon:
+            run_daemon(args.interval, args.max_runtime, args.flush_interval, args.requests_per_minute)
+        else:
+            main(requests_per_minute=args.requests_per_minute)
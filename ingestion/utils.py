@@ -1,5 +1,9 @@
+import hashlib
+import io
 import xml.etree.ElementTree as ET
+from collections import namedtuple
 from datetime import datetime
+from functools import lru_cache
 
 STATION_NAMES = [
     "Hamburg Hbf", 
@@ -15,82 +19,148 @@ STATION_NAMES = [
     "Braunschweig Hbf"
 ]
 
-def fetch_eva_number(conn, station):
-    try:
-        with conn.cursor() as cur:
-            cur.execute(f"SELECT eva_number FROM raw_stations WHERE name='{station}';")
-            rows = cur.fetchall()
-            return rows[0][0]
-    except Exception as e:
-        print(f"Error while fetching eva-number for station {station}. Error: {e}")
-    return None
+def copy_rows(cur, table, columns, rows):
+    """
+    Stream rows into `table` with COPY and return the number of rows written.
+    """
+    count = 0
+    with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row(row)
+            count += 1
+    return count
+
+# Channel on which writers announce the tables they changed, e.g. to the dashboard
+TABLE_CHANGES_CHANNEL = "table_changes"
+
+def notify_table_changes(cur, *tables):
+    """
+    Queue a notification naming each changed table on TABLE_CHANGES_CHANNEL.
+    Postgres delivers it to listeners when the current transaction commits.
+    """
+    for table in tables:
+        cur.execute("SELECT pg_notify(%s, %s);", (TABLE_CHANGES_CHANNEL, table))
+
+# Compact stop records yielded by the streaming parsers. PlannedStop fields follow
+# the raw_timetable column order so a record can be written as (eva_number, *stop).
+PlannedStop = namedtuple("PlannedStop", [
+    "service_id",
+    "train_category",
+    "train_number",
+    "train_operator",
+    "platform",
+    "route_before_arrival",
+    "route_after_departure",
+    "planned_arrival_time",
+    "planned_departure_time",
+])
+StopChange = namedtuple("StopChange", [
+    "service_id",
+    "actual_arrival_time",
+    "actual_departure_time",
+])
+
+NO_ATTRIBUTES = {}
+
+def stop_key(row):
+    """
+    Compact 64-bit key identifying a raw_timetable stop, computed from
+    (eva_number, service_id, train_category, train_number, train_operator,
+    platform, route_before_arrival, route_after_departure, planned_arrival_time,
+    planned_departure_time). Must stay in sync with the SQL expression in
+    migrations/003_raw_timetable_stop_key.sql.
+    """
+    parts = []
+    for value in row:
+        if value is None:
+            parts.append("")
+        elif isinstance(value, datetime):
+            parts.append(value.strftime("%y%m%d%H%M"))
+        else:
+            parts.append(str(value))
+    digest = hashlib.md5("\x1f".join(parts).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big", signed=True)
 
+@lru_cache(maxsize=4096)
 def parse_db_time(ts):
+    # The same yyMMddHHmm values repeat constantly within a response, so cache them
     return datetime.strptime(ts, "%y%m%d%H%M") if ts else None
 
-def parse_planned_timetable(response):
-    root = ET.fromstring(response)
-    stops = {}
-
-    for stop in root.findall("s"):
-        service_id = stop.attrib.get("id")
-        stop_data = {}
-
-        # Train info
-        trip_label = stop.find("tl")
-        stop_data["train_category"] = trip_label.attrib.get("c") if trip_label is not None else None
-        stop_data["train_number"] = trip_label.attrib.get("n") if trip_label is not None else None
-        stop_data["train_operator"] = trip_label.attrib.get("o") if trip_label is not None else None
-
-        # Arrival
-        ar = stop.find("ar")
-        if ar is not None:
-            stop_data["platform"] = ar.attrib.get("pp")
-            stop_data["route_before_arrival"] = ar.attrib.get("ppth")
-            stop_data["planned_arrival_time"] = parse_db_time(ar.attrib.get("pt"))
-        else:
-            stop_data["platform"] = None
-            stop_data["route_before_arrival"] = None
-            stop_data["planned_arrival_time"] = None
-
-        # Departure
-        dp = stop.find("dp")
-        if dp is not None:
-            stop_data["route_after_departure"] = dp.attrib.get("ppth")
-            stop_data["planned_departure_time"] = parse_db_time(dp.attrib.get("pt"))
-        else:
-            stop_data["route_after_departure"] = None
-            stop_data["planned_departure_time"] = None
+def iter_stop_elements(response):
+    """
+    Incrementally parse a timetable response (str, bytes or a binary file object)
+    and yield (service_id, {child_tag: attributes}) for every top-level <s> element.
+    Only the first occurrence of each direct child tag is kept, and every element is
+    discarded once consumed, so memory stays flat regardless of payload size.
+    """
+    if isinstance(response, bytes):
+        source = io.BytesIO(response)
+    elif isinstance(response, str):
+        source = io.StringIO(response)
+    else:
+        source = response
+
+    depth = 0
+    root = None
+    children = {}
+    for event, elem in ET.iterparse(source, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+            continue
+
+        depth -= 1
+        if depth == 2:
+            children.setdefault(elem.tag, elem.attrib)
+        elif depth == 1:
+            if elem.tag == "s":
+                yield elem.attrib.get("id"), children
+            children = {}
+            root.clear()
+
+def iter_planned_timetable(response):
+    """
+    Yield a PlannedStop for every stop of a plan response as it is parsed.
+    """
+    for service_id, children in iter_stop_elements(response):
+        tl = children.get("tl", NO_ATTRIBUTES)
+        ar = children.get("ar", NO_ATTRIBUTES)
+        dp = children.get("dp", NO_ATTRIBUTES)
+        yield PlannedStop(
+            service_id,
+            tl.get("c"),
+            tl.get("n"),
+            tl.get("o"),
+            ar.get("pp"),
+            ar.get("ppth"),
+            dp.get("ppth"),
+            parse_db_time(ar.get("pt")),
+            parse_db_time(dp.get("pt")),
+        )
+
+def iter_recent_changes(response):
+    """
+    Yield a StopChange for every stop of a rchg/fchg response as it is parsed.
+    """
+    for service_id, children in iter_stop_elements(response):
+        yield StopChange(
+            service_id,
+            parse_db_time(children.get("ar", NO_ATTRIBUTES).get("ct")),
+            parse_db_time(children.get("dp", NO_ATTRIBUTES).get("ct")),
+        )
 
-        stops[service_id] = stop_data
-
-    return stops
+def parse_planned_timetable(response):
+    return {
+        stop.service_id: dict(zip(PlannedStop._fields[1:], stop[1:]))
+        for stop in iter_planned_timetable(response)
+    }
 
 def parse_recent_changes(response):
-    root = ET.fromstring(response)
-    stops = {}
-
-    for stop in root.findall("s"):
-        service_id = stop.attrib.get("id")
-        stop_data = {}
-
-        # Actual arrival
-        ar = stop.find("ar")
-        if ar is not None:
-            stop_data["actual_arrival_time"] = parse_db_time(ar.attrib.get("ct"))
-        else:
-            stop_data["actual_arrival_time"] = None
-
-        # Actual departure
-        dp = stop.find("dp")
-        if dp is not None:
-            stop_data["actual_departure_time"] = parse_db_time(dp.attrib.get("ct"))
-        else:
-            stop_data["actual_departure_time"] = None
-
-        stops[service_id] = stop_data
-
-    return stops
+    return {
+        change.service_id: dict(zip(StopChange._fields[1:], change[1:]))
+        for change in iter_recent_changes(response)
+    }
 
 # def fetch_states(conn):
 #     try:
@@ -1,9 +1,12 @@
 import os
 import streamlit as st
 import pandas as pd
-import psycopg
 import plotly.express as px
 from dotenv import load_dotenv
+from dashboard.data import MART_COLUMNS, create_pool, load_station_range
+from dashboard.insights import join_labels, summarize
+from dashboard.notifications import start_listener
+from dashboard.snapshots import load_snapshots
 from ingestion.utils import STATION_NAMES
 
 # -----------------------------
@@ -19,39 +22,71 @@ if not conn_string:
 # -----------------------------
 # Database connection
 # -----------------------------
-@st.cache_data(ttl=600)
-def load_data(table_name):
+@st.cache_resource
+def get_pool():
     """
-    Load aggregated hourly delay data from the fct_train_delay_summary table.
-    The cache refreshes every 10 minutes (600 seconds).
+    Connection pool shared by every session of this Streamlit process.
     """
-    conn = psycopg.connect(conn_string)
-    query = f"SELECT * FROM {table_name}"
-    df = pd.read_sql(query, conn)
-    conn.close()
-    return df
-
-@st.cache_data(ttl=600)
-def load_station_day_hour_data(selected_date, selected_station):
+    return create_pool(conn_string)
+
+@st.cache_data(ttl=3600)
+def load_marts():
+    """
+    Load every mart table the dashboard shows, concurrently, in one warmup pass.
+    Tables are served from local snapshots that only fetch changed rows.
+    The cache is cleared by the table change listener and refreshes at the latest
+    every hour (3600 seconds).
     """
-    Load daily hourly delay data for a specific station and date from fct_station_day_hour_summary.
-    The cache refreshes every 10 minutes (600 seconds).
+    return load_snapshots(get_pool())
+
+@st.cache_data(ttl=3600)
+def load_station_range_data(start_date, end_date):
     """
-    conn = psycopg.connect(conn_string)
-    query = """
-        SELECT 
-            date, 
-            hour, 
-            station_name, 
-            avg_arrival_delay_min, 
-            avg_departure_delay_min
-        FROM fct_station_day_hour_summary
-        WHERE date = %s AND station_name = %s
-        ORDER BY hour
+    Load hourly (or, for long spans, daily) delays of all stations between two dates
+    from fct_station_day_hour_summary. Station selection filters the cached result,
+    so only changing the dates queries the database.
+    The cache is cleared by the table change listener and refreshes at the latest
+    every hour (3600 seconds).
     """
-    df = pd.read_sql(query, conn, params=(selected_date, selected_station))
-    conn.close()
-    return df
+    return load_station_range(get_pool(), start_date, end_date, STATION_NAMES)
+
+@st.cache_data(max_entries=32)
+def mart_insights(table_name, version, label, metrics, _frame):
+    """
+    Insight figures of a mart table, recomputed only when the table version changes.
+    """
+    return summarize(_frame, label, metrics)
+
+def insights_for(table_name, label, metrics):
+    frame = marts[table_name]
+    return mart_insights(table_name, frame.attrs.get("version"), label, metrics, frame)
+
+# Cached loaders reading each table
+CACHE_INVALIDATIONS = {
+    **{table_name: [load_marts] for table_name in MART_COLUMNS},
+    "fct_station_day_hour_summary": [load_station_range_data],
+}
+
+@st.cache_resource
+def start_change_listener():
+    """
+    Keep one LISTEN connection per Streamlit process and clear the cached loaders of
+    every table that the ingestion jobs or dbt announce as changed. Idle periods
+    cost no queries. After a reconnect (table_name None) all loaders are cleared.
+    """
+    def on_change(table_name):
+        if table_name is None:
+            loaders = {loader for loaders in CACHE_INVALIDATIONS.values() for loader in loaders}
+        else:
+            loaders = CACHE_INVALIDATIONS.get(table_name, [])
+        for loader in loaders:
+            loader.clear()
+
+    # LISTEN needs a direct connection; pooled (PgBouncer) endpoints drop notifications
+    return start_listener(os.getenv('LISTEN_DATABASE_URL', conn_string), on_change)
+
+start_change_listener()
+marts = load_marts()
 
 # -----------------------------
 # App Title & Introduction
@@ -81,7 +116,7 @@ Columns include:
 - **total_delays**: Total number of delayed events recorded for that hour.
 """)
 
-df_train_delay = load_data("fct_train_delay_summary")
+df_train_delay = marts["fct_train_delay_summary"]
 st.dataframe(df_train_delay)
 
 # -----------------------------
@@ -121,38 +156,20 @@ st.plotly_chart(fig_avg_delay, use_container_width=True)
 # Dynamic insights for average delays per hour
 st.subheader("📊 Insights: Average Delays by Hour")
 if not df_train_delay.empty:
-    # Find peak hours
-    max_arrival_hour = df_train_delay.loc[df_train_delay['avg_arrival_delay_min'].idxmax()]
-    min_arrival_hour = df_train_delay.loc[df_train_delay['avg_arrival_delay_min'].idxmin()]
-    max_departure_hour = df_train_delay.loc[df_train_delay['avg_departure_delay_min'].idxmax()]
-    min_departure_hour = df_train_delay.loc[df_train_delay['avg_departure_delay_min'].idxmin()]
-    
-    overall_avg_arrival = df_train_delay['avg_arrival_delay_min'].mean()
-    overall_avg_departure = df_train_delay['avg_departure_delay_min'].mean()
-    
-    # Find peak hours (handle ties)
-    max_arr_val = df_train_delay['avg_arrival_delay_min'].max()
-    min_arr_val = df_train_delay['avg_arrival_delay_min'].min()
-    max_dep_val = df_train_delay['avg_departure_delay_min'].max()
-    min_dep_val = df_train_delay['avg_departure_delay_min'].min()
-    
-    peak_arrival_hours = df_train_delay[df_train_delay['avg_arrival_delay_min'] == max_arr_val]['hour_of_day'].tolist()
-    best_arrival_hours = df_train_delay[df_train_delay['avg_arrival_delay_min'] == min_arr_val]['hour_of_day'].tolist()
-    peak_departure_hours = df_train_delay[df_train_delay['avg_departure_delay_min'] == max_dep_val]['hour_of_day'].tolist()
-    best_departure_hours = df_train_delay[df_train_delay['avg_departure_delay_min'] == min_dep_val]['hour_of_day'].tolist()
-    
-    peak_arr_str = ", ".join([f"{h}:00" for h in peak_arrival_hours])
-    best_arr_str = ", ".join([f"{h}:00" for h in best_arrival_hours])
-    peak_dep_str = ", ".join([f"{h}:00" for h in peak_departure_hours])
-    best_dep_str = ", ".join([f"{h}:00" for h in best_departure_hours])
+    hourly = insights_for(
+        "fct_train_delay_summary", "hour_of_day",
+        ("avg_arrival_delay_min", "avg_departure_delay_min", "total_delays"),
+    )
+    arrival = hourly["avg_arrival_delay_min"]
+    departure = hourly["avg_departure_delay_min"]
     
     insights_hourly = f"""
-    - **Peak Arrival Delays:** {peak_arr_str} with {max_arr_val:.1f} min average delay
-    - **Best Arrival Performance:** {best_arr_str} with {min_arr_val:.1f} min average delay
-    - **Peak Departure Delays:** {peak_dep_str} with {max_dep_val:.1f} min average delay
-    - **Best Departure Performance:** {best_dep_str} with {min_dep_val:.1f} min average delay
-    - **Overall Average Arrival Delay:** {overall_avg_arrival:.1f} min
-    - **Overall Average Departure Delay:** {overall_avg_departure:.1f} min
+    - **Peak Arrival Delays:** {join_labels(arrival.max_labels, "{}:00")} with {arrival.max:.1f} min average delay
+    - **Best Arrival Performance:** {join_labels(arrival.min_labels, "{}:00")} with {arrival.min:.1f} min average delay
+    - **Peak Departure Delays:** {join_labels(departure.max_labels, "{}:00")} with {departure.max:.1f} min average delay
+    - **Best Departure Performance:** {join_labels(departure.min_labels, "{}:00")} with {departure.min:.1f} min average delay
+    - **Overall Average Arrival Delay:** {arrival.mean:.1f} min
+    - **Overall Average Departure Delay:** {departure.mean:.1f} min
     """
     st.markdown(insights_hourly)
 
@@ -191,27 +208,16 @@ st.plotly_chart(fig_count, use_container_width=True)
 # Dynamic insights for total delays per hour
 st.subheader("📈 Insights: Delay Frequency by Hour")
 if not df_train_delay.empty:
-    # Find peak and off-peak hours
-    max_delays_count = df_train_delay['total_delays'].max()
-    min_delays_count = df_train_delay['total_delays'].min()
-    
-    peak_delay_hours = df_train_delay[df_train_delay['total_delays'] == max_delays_count]['hour_of_day'].tolist()
-    off_peak_hours = df_train_delay[df_train_delay['total_delays'] == min_delays_count]['hour_of_day'].tolist()
-    
-    total_all_delays = df_train_delay['total_delays'].sum()
-    avg_delays_per_hour = df_train_delay['total_delays'].mean()
-    
-    peak_pct = (max_delays_count / total_all_delays * 100) if total_all_delays > 0 else 0
-    off_peak_pct = (min_delays_count / total_all_delays * 100) if total_all_delays > 0 else 0
-    
-    peak_str = ", ".join([f"{h}:00" for h in peak_delay_hours])
-    off_peak_str = ", ".join([f"{h}:00" for h in off_peak_hours])
+    delays = insights_for(
+        "fct_train_delay_summary", "hour_of_day",
+        ("avg_arrival_delay_min", "avg_departure_delay_min", "total_delays"),
+    )["total_delays"]
     
     insights_freq = f"""
-    - **Peak Delay Hours:** {peak_str} with {int(max_delays_count)} total delays ({peak_pct:.1f}% of all delays)
-    - **Off-Peak Hours:** {off_peak_str} with {int(min_delays_count)} total delays ({off_peak_pct:.1f}% of all delays)
-    - **Total Delays Across All Hours:** {int(total_all_delays)} events
-    - **Average Delays per Hour:** {avg_delays_per_hour:.0f} events
+    - **Peak Delay Hours:** {join_labels(delays.max_labels, "{}:00")} with {int(delays.max)} total delays ({delays.max_share:.1f}% of all delays)
+    - **Off-Peak Hours:** {join_labels(delays.min_labels, "{}:00")} with {int(delays.min)} total delays ({delays.min_share:.1f}% of all delays)
+    - **Total Delays Across All Hours:** {int(delays.total)} events
+    - **Average Delays per Hour:** {delays.mean:.0f} events
     """
     st.markdown(insights_freq)
 
@@ -226,7 +232,7 @@ for each major station.
 It helps identify which stations experience the **longest delays** or the **most frequent disruptions**.
 """)
 
-df_station_data = load_data("fct_station_delay_summary")
+df_station_data = marts["fct_station_delay_summary"]
 
 # Melt the DataFrame to long format for grouped bars
 station_melted = df_station_data.melt(
@@ -259,42 +265,24 @@ st.plotly_chart(fig_station, use_container_width=True)
 # Dynamic insights for station delays
 st.subheader("🚉 Insights: Station Performance")
 if not df_station_data.empty:
-    # Find worst and best performing stations
-    max_arrival_delay = df_station_data['avg_arrival_delay_min'].max()
-    min_arrival_delay = df_station_data['avg_arrival_delay_min'].min()
-    max_departure_delay = df_station_data['avg_departure_delay_min'].max()
-    min_departure_delay = df_station_data['avg_departure_delay_min'].min()
-    max_total_delays = df_station_data['total_delays'].max()
-    min_total_delays = df_station_data['total_delays'].min()
-    
-    worst_arrival_stations = df_station_data[df_station_data['avg_arrival_delay_min'] == max_arrival_delay]['station_name'].tolist()
-    best_arrival_stations = df_station_data[df_station_data['avg_arrival_delay_min'] == min_arrival_delay]['station_name'].tolist()
-    worst_departure_stations = df_station_data[df_station_data['avg_departure_delay_min'] == max_departure_delay]['station_name'].tolist()
-    best_departure_stations = df_station_data[df_station_data['avg_departure_delay_min'] == min_departure_delay]['station_name'].tolist()
-    most_disrupted_stations = df_station_data[df_station_data['total_delays'] == max_total_delays]['station_name'].tolist()
-    least_disrupted_stations = df_station_data[df_station_data['total_delays'] == min_total_delays]['station_name'].tolist()
-    
-    overall_avg_arrival = df_station_data['avg_arrival_delay_min'].mean()
-    overall_avg_departure = df_station_data['avg_departure_delay_min'].mean()
-    total_all_station_delays = df_station_data['total_delays'].sum()
-    
-    worst_arr_str = ", ".join(worst_arrival_stations)
-    best_arr_str = ", ".join(best_arrival_stations)
-    worst_dep_str = ", ".join(worst_departure_stations)
-    best_dep_str = ", ".join(best_departure_stations)
-    most_disrupted_str = ", ".join(most_disrupted_stations)
-    least_disrupted_str = ", ".join(least_disrupted_stations)
+    stations = insights_for(
+        "fct_station_delay_summary", "station_name",
+        ("avg_arrival_delay_min", "avg_departure_delay_min", "total_delays"),
+    )
+    arrival = stations["avg_arrival_delay_min"]
+    departure = stations["avg_departure_delay_min"]
+    delays = stations["total_delays"]
     
     insights_station = f"""
-    - **Worst Arrival Performance:** {worst_arr_str} with {max_arrival_delay:.1f} min average delay
-    - **Best Arrival Performance:** {best_arr_str} with {min_arrival_delay:.1f} min average delay
-    - **Worst Departure Performance:** {worst_dep_str} with {max_departure_delay:.1f} min average delay
-    - **Best Departure Performance:** {best_dep_str} with {min_departure_delay:.1f} min average delay
-    - **Most Disrupted Station:** {most_disrupted_str} with {int(max_total_delays)} total delays
-    - **Least Disrupted Station:** {least_disrupted_str} with {int(min_total_delays)} total delays
-    - **Overall Average Arrival Delay:** {overall_avg_arrival:.1f} min
-    - **Overall Average Departure Delay:** {overall_avg_departure:.1f} min
-    - **Total Delays Across All Stations:** {int(total_all_station_delays)} events
+    - **Worst Arrival Performance:** {join_labels(arrival.max_labels)} with {arrival.max:.1f} min average delay
+    - **Best Arrival Performance:** {join_labels(arrival.min_labels)} with {arrival.min:.1f} min average delay
+    - **Worst Departure Performance:** {join_labels(departure.max_labels)} with {departure.max:.1f} min average delay
+    - **Best Departure Performance:** {join_labels(departure.min_labels)} with {departure.min:.1f} min average delay
+    - **Most Disrupted Station:** {join_labels(delays.max_labels)} with {int(delays.max)} total delays
+    - **Least Disrupted Station:** {join_labels(delays.min_labels)} with {int(delays.min)} total delays
+    - **Overall Average Arrival Delay:** {arrival.mean:.1f} min
+    - **Overall Average Departure Delay:** {departure.mean:.1f} min
+    - **Total Delays Across All Stations:** {int(delays.total)} events
     """
     st.markdown(insights_station)
 
@@ -316,7 +304,7 @@ st.markdown("""
 # It helps identify which operators maintain better punctuality and which ones experience more disruptions.
 # """)
 
-# df_operator_data = load_data("fct_operator_delay_summary")
+# df_operator_data = marts["fct_operator_delay_summary"]
 
 # # Create grouped bar chart for operators
 # fig_operator = px.bar(
@@ -379,7 +367,7 @@ This section breaks down delays by **train category** (e.g., ICE, Regional, S-Ba
 It reveals whether certain train types are more prone to delays than others.
 """)
 
-df_category_data = load_data("fct_train_category_delay_summary")
+df_category_data = marts["fct_train_category_delay_summary"]
 
 # Create grouped bar chart for categories
 fig_category = px.bar(
@@ -413,33 +401,20 @@ st.plotly_chart(fig_category, use_container_width=True)
 # Dynamic conclusion for average delays
 st.subheader("📊 Insights: Average Delays by Category")
 if not df_category_data.empty:
-    # Find worst and best performing categories (handling ties)
-    max_arrival_delay = df_category_data['avg_arrival_delay_min'].max()
-    min_arrival_delay = df_category_data['avg_arrival_delay_min'].min()
-    max_departure_delay = df_category_data['avg_departure_delay_min'].max()
-    min_departure_delay = df_category_data['avg_departure_delay_min'].min()
-    
-    worst_arrival_cats = df_category_data[df_category_data['avg_arrival_delay_min'] == max_arrival_delay]['train_category'].tolist()
-    best_arrival_cats = df_category_data[df_category_data['avg_arrival_delay_min'] == min_arrival_delay]['train_category'].tolist()
-    worst_departure_cats = df_category_data[df_category_data['avg_departure_delay_min'] == max_departure_delay]['train_category'].tolist()
-    best_departure_cats = df_category_data[df_category_data['avg_departure_delay_min'] == min_departure_delay]['train_category'].tolist()
-    
-    avg_arrival = df_category_data['avg_arrival_delay_min'].mean()
-    avg_departure = df_category_data['avg_departure_delay_min'].mean()
-    
-    # Format category lists
-    worst_arrival_str = ", ".join(worst_arrival_cats)
-    best_arrival_str = ", ".join(best_arrival_cats)
-    worst_departure_str = ", ".join(worst_departure_cats)
-    best_departure_str = ", ".join(best_departure_cats)
+    categories = insights_for(
+        "fct_train_category_delay_summary", "train_category",
+        ("avg_arrival_delay_min", "avg_departure_delay_min", "total_delays"),
+    )
+    arrival = categories["avg_arrival_delay_min"]
+    departure = categories["avg_departure_delay_min"]
     
     conclusion = f"""
-    - **Worst Arrival Performance:** {worst_arrival_str} with {max_arrival_delay:.1f} min average delay
-    - **Best Arrival Performance:** {best_arrival_str} with {min_arrival_delay:.1f} min average delay
-    - **Worst Departure Performance:** {worst_departure_str} with {max_departure_delay:.1f} min average delay
-    - **Best Departure Performance:** {best_departure_str} with {min_departure_delay:.1f} min average delay
-    - **Overall Average Arrival Delay:** {avg_arrival:.1f} min
-    - **Overall Average Departure Delay:** {avg_departure:.1f} min
+    - **Worst Arrival Performance:** {join_labels(arrival.max_labels)} with {arrival.max:.1f} min average delay
+    - **Best Arrival Performance:** {join_labels(arrival.min_labels)} with {arrival.min:.1f} min average delay
+    - **Worst Departure Performance:** {join_labels(departure.max_labels)} with {departure.max:.1f} min average delay
+    - **Best Departure Performance:** {join_labels(departure.min_labels)} with {departure.min:.1f} min average delay
+    - **Overall Average Arrival Delay:** {arrival.mean:.1f} min
+    - **Overall Average Departure Delay:** {departure.mean:.1f} min
     """
     st.markdown(conclusion)
 
@@ -468,27 +443,16 @@ st.plotly_chart(fig_category_count, use_container_width=True)
 # Dynamic conclusion for delay frequency
 st.subheader("📈 Insights: Delay Frequency by Category")
 if not df_category_data.empty:
-    # Handle ties for most and least delays
-    max_delays_count = df_category_data['total_delays'].max()
-    min_delays_count = df_category_data['total_delays'].min()
-    
-    most_delays_cats = df_category_data[df_category_data['total_delays'] == max_delays_count]['train_category'].tolist()
-    least_delays_cats = df_category_data[df_category_data['total_delays'] == min_delays_count]['train_category'].tolist()
-    
-    total_all_delays = df_category_data['total_delays'].sum()
-    
-    most_delays_pct = (max_delays_count / total_all_delays * 100) if total_all_delays > 0 else 0
-    least_delays_pct = (min_delays_count / total_all_delays * 100) if total_all_delays > 0 else 0
-    
-    # Format category lists
-    most_delays_str = ", ".join(most_delays_cats)
-    least_delays_str = ", ".join(least_delays_cats)
+    delays = insights_for(
+        "fct_train_category_delay_summary", "train_category",
+        ("avg_arrival_delay_min", "avg_departure_delay_min", "total_delays"),
+    )["total_delays"]
     
     conclusion_freq = f"""
-    - **Most Frequent Delays:** {most_delays_str} with {int(max_delays_count)} total delays ({most_delays_pct:.1f}% of all delays)
-    - **Least Frequent Delays:** {least_delays_str} with {int(min_delays_count)} total delays ({least_delays_pct:.1f}% of all delays)
-    - **Total Delays Across All Categories:** {int(total_all_delays)} events
-    - **Average Delays per Category:** {int(total_all_delays / len(df_category_data)):.0f} events
+    - **Most Frequent Delays:** {join_labels(delays.max_labels)} with {int(delays.max)} total delays ({delays.max_share:.1f}% of all delays)
+    - **Least Frequent Delays:** {join_labels(delays.min_labels)} with {int(delays.min)} total delays ({delays.min_share:.1f}% of all delays)
+    - **Total Delays Across All Categories:** {int(delays.total)} events
+    - **Average Delays per Category:** {int(delays.total / len(df_category_data)):.0f} events
     """
     st.markdown(conclusion_freq)
 
@@ -499,97 +463,176 @@ st.header("📅 Daily Station Delay Analysis")
 
 st.markdown("""
 This section allows you to explore **hourly delay patterns** for a specific station on a selected date.  
-Choose a date and station to view how delays vary throughout the day.
+Choose a date and station to view how delays vary throughout the day, or switch to **Date range** 
+to compare several stations over a longer period.
 """)
 
-# Create two columns for date and station selection
-col1, col2 = st.columns(2)
+view_mode = st.radio(
+    "View",
+    options=["Single day", "Date range"],
+    horizontal=True,
+    help="Spans longer than two weeks are shown as daily averages"
+)
 
-with col1:
-    selected_date = st.date_input(
-        "Select Date",
-        value=pd.Timestamp.now().date(),
-        help="Choose a date to analyze delays"
-    )
+if view_mode == "Single day":
+    # Create two columns for date and station selection
+    col1, col2 = st.columns(2)
 
-with col2:
-    selected_station = st.selectbox(
-        "Select Station",
-        options=STATION_NAMES,
-        help="Choose a station from the list"
-    )
+    with col1:
+        selected_date = st.date_input(
+            "Select Date",
+            value=pd.Timestamp.now().date(),
+            help="Choose a date to analyze delays"
+        )
+
+    with col2:
+        selected_station = st.selectbox(
+            "Select Station",
+            options=STATION_NAMES,
+            help="Choose a station from the list"
+        )
+else:
+    col1, col2 = st.columns(2)
+
+    with col1:
+        date_span = st.date_input(
+            "Select Date Range",
+            value=(pd.Timestamp.now().date() - pd.Timedelta(days=6), pd.Timestamp.now().date()),
+            help="Choose the first and last date to analyze"
+        )
+
+    with col2:
+        selected_stations = st.multiselect(
+            "Select Stations",
+            options=STATION_NAMES,
+            default=STATION_NAMES[:1],
+            help="Choose one or more stations to compare"
+        )
 
 # Fetch and display data
 try:
-    df_station_day_hour = load_station_day_hour_data(selected_date, selected_station)
+    if view_mode == "Single day":
+        df_stations = load_station_range_data(selected_date, selected_date)
+        df_station_day_hour = df_stations[df_stations["station_name"] == selected_station].reset_index(drop=True)
     
-    if df_station_day_hour.empty:
-        st.warning(f"No data available for {selected_station} on {selected_date}. Please select a different date or station.")
-    else:
-        # Display data table
-        st.subheader(f"Hourly Delays for {selected_station} on {selected_date}")
-        st.dataframe(df_station_day_hour, use_container_width=True)
+        if df_station_day_hour.empty:
+            st.warning(f"No data available for {selected_station} on {selected_date}. Please select a different date or station.")
+        else:
+            # Display data table
+            st.subheader(f"Hourly Delays for {selected_station} on {selected_date}")
+            st.dataframe(df_station_day_hour, use_container_width=True)
         
-        # Create bar chart for average delays by hour
-        fig_daily = px.bar(
-            df_station_day_hour,
-            x="hour",
-            y=["avg_arrival_delay_min", "avg_departure_delay_min"],
-            barmode="group",
-            labels={
-                "hour": "Hour of Day",
-                "value": "Average Delay (min)",
-                "variable": "Delay Type",
-                "avg_arrival_delay_min": "Average Arrival Delay (minutes)",
-                "avg_departure_delay_min": "Average Departure Delay (minutes)"
-            },
-            title=f"Hourly Average Delays - {selected_station} ({selected_date})",
-            color_discrete_map={
-                "avg_arrival_delay_min": "#636EFA",
-                "avg_departure_delay_min": "#EF553B"
-            }
-        )
+            # Create bar chart for average delays by hour
+            fig_daily = px.bar(
+                df_station_day_hour,
+                x="hour",
+                y=["avg_arrival_delay_min", "avg_departure_delay_min"],
+                barmode="group",
+                labels={
+                    "hour": "Hour of Day",
+                    "value": "Average Delay (min)",
+                    "variable": "Delay Type",
+                    "avg_arrival_delay_min": "Average Arrival Delay (minutes)",
+                    "avg_departure_delay_min": "Average Departure Delay (minutes)"
+                },
+                title=f"Hourly Average Delays - {selected_station} ({selected_date})",
+                color_discrete_map={
+                    "avg_arrival_delay_min": "#636EFA",
+                    "avg_departure_delay_min": "#EF553B"
+                }
+            )
         
-        fig_daily.update_layout(
-            xaxis=dict(
-                tickmode="linear",
-                dtick=1,
-                title="Hour of Day (0-23)"
-            ),
-            yaxis_title="Average Delay (minutes)",
-            legend_title="Delay Type",
-            height=500,
-            hovermode="x unified"
-        )
+            fig_daily.update_layout(
+                xaxis=dict(
+                    tickmode="linear",
+                    dtick=1,
+                    title="Hour of Day (0-23)"
+                ),
+                yaxis_title="Average Delay (minutes)",
+                legend_title="Delay Type",
+                height=500,
+                hovermode="x unified"
+            )
         
-        st.plotly_chart(fig_daily, use_container_width=True)
+            st.plotly_chart(fig_daily, use_container_width=True)
         
-        # Display insights
-        st.subheader("📊 Insights")
-        if not df_station_day_hour.empty:
-            max_arrival_delay = df_station_day_hour['avg_arrival_delay_min'].max()
-            min_arrival_delay = df_station_day_hour['avg_arrival_delay_min'].min()
-            max_departure_delay = df_station_day_hour['avg_departure_delay_min'].max()
-            min_departure_delay = df_station_day_hour['avg_departure_delay_min'].min()
-            
-            max_arrival_hour = df_station_day_hour[df_station_day_hour['avg_arrival_delay_min'] == max_arrival_delay]['hour'].values[0]
-            min_arrival_hour = df_station_day_hour[df_station_day_hour['avg_arrival_delay_min'] == min_arrival_delay]['hour'].values[0]
-            max_departure_hour = df_station_day_hour[df_station_day_hour['avg_departure_delay_min'] == max_departure_delay]['hour'].values[0]
-            min_departure_hour = df_station_day_hour[df_station_day_hour['avg_departure_delay_min'] == min_departure_delay]['hour'].values[0]
-            
-            avg_arrival = df_station_day_hour['avg_arrival_delay_min'].mean()
-            avg_departure = df_station_day_hour['avg_departure_delay_min'].mean()
+            # Display insights
+            st.subheader("📊 Insights")
+            if not df_station_day_hour.empty:
+                daily = summarize(df_station_day_hour, "hour", ("avg_arrival_delay_min", "avg_departure_delay_min"))
+                arrival = daily["avg_arrival_delay_min"]
+                departure = daily["avg_departure_delay_min"]
             
-            insights_daily = f"""
-            - **Peak Arrival Delay:** {max_arrival_delay:.1f} min at {int(max_arrival_hour)}:00
-            - **Best Arrival Performance:** {min_arrival_delay:.1f} min at {int(min_arrival_hour)}:00
-            - **Peak Departure Delay:** {max_departure_delay:.1f} min at {int(max_departure_hour)}:00
-            - **Best Departure Performance:** {min_departure_delay:.1f} min at {int(min_departure_hour)}:00
-            - **Average Arrival Delay:** {avg_arrival:.1f} min
-            - **Average Departure Delay:** {avg_departure:.1f} min
+                insights_daily = f"""
+                - **Peak Arrival Delay:** {arrival.max:.1f} min at {int(arrival.max_labels[0])}:00
+                - **Best Arrival Performance:** {arrival.min:.1f} min at {int(arrival.min_labels[0])}:00
+                - **Peak Departure Delay:** {departure.max:.1f} min at {int(departure.max_labels[0])}:00
+                - **Best Departure Performance:** {departure.min:.1f} min at {int(departure.min_labels[0])}:00
+                - **Average Arrival Delay:** {arrival.mean:.1f} min
+                - **Average Departure Delay:** {departure.mean:.1f} min
+                """
+                st.markdown(insights_daily)
+    elif len(date_span) < 2:
+        st.info("Select the last date of the range.")
+    elif not selected_stations:
+        st.info("Select at least one station.")
+    else:
+        start_date, end_date = date_span
+        df_stations = load_station_range_data(start_date, end_date)
+        df_range = df_stations[df_stations["station_name"].isin(selected_stations)]
+
+        if df_range.empty:
+            st.warning(f"No data available for the selected stations between {start_date} and {end_date}.")
+        else:
+            hourly = "hour" in df_range.columns
+            df_plot = df_range.assign(
+                time=df_range["date"] + pd.to_timedelta(df_range["hour"], unit="h") if hourly else df_range["date"]
+            ).rename(columns={
+                "avg_arrival_delay_min": "Arrival",
+                "avg_departure_delay_min": "Departure"
+            }).melt(
+                id_vars=["time", "station_name"],
+                value_vars=["Arrival", "Departure"],
+                var_name="Delay Type",
+                value_name="Average Delay (min)"
+            )
+
+            fig_range = px.line(
+                df_plot,
+                x="time",
+                y="Average Delay (min)",
+                color="station_name",
+                facet_row="Delay Type",
+                labels={
+                    "time": "Hour" if hourly else "Date",
+                    "station_name": "Station"
+                },
+                title=f"{'Hourly' if hourly else 'Daily'} Average Delays ({start_date} to {end_date})"
+            )
+
+            fig_range.update_layout(height=700, hovermode="x unified")
+
+            st.plotly_chart(fig_range, use_container_width=True)
+
+            # Compare the stations over the whole span
+            st.subheader("📊 Insights")
+            station_means = df_range.groupby("station_name", observed=True)[
+                ["avg_arrival_delay_min", "avg_departure_delay_min"]
+            ].mean().reset_index()
+            span = summarize(station_means, "station_name", ("avg_arrival_delay_min", "avg_departure_delay_min"))
+            arrival = span["avg_arrival_delay_min"]
+            departure = span["avg_departure_delay_min"]
+
+            insights_range = f"""
+            - **Worst Arrival Performance:** {join_labels(arrival.max_labels)} with {arrival.max:.1f} min average delay
+            - **Best Arrival Performance:** {join_labels(arrival.min_labels)} with {arrival.min:.1f} min average delay
+            - **Worst Departure Performance:** {join_labels(departure.max_labels)} with {departure.max:.1f} min average delay
+            - **Best Departure Performance:** {join_labels(departure.min_labels)} with {departure.min:.1f} min average delay
+            - **Average Arrival Delay:** {arrival.mean:.1f} min
+            - **Average Departure Delay:** {departure.mean:.1f} min
             """
-            st.markdown(insights_daily)
-            
+            st.markdown(insights_range)
+
 except Exception as e:
     st.error(f"Error loading data: {str(e)}")
 
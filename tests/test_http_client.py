@@ -0,0 +1,167 @@
+"""
+Regression tests of the shared API client against a local HTTP stub server.
+
+Run from the repository root:
+    python -m pytest tests
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from ingestion.http_client import ApiClient, CircuitBreaker, CircuitOpenError, TokenBucket, retry_after
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, time.monotonic()))
+            answers = server.answers.get(self.path, [])
+            status, headers = answers.pop(0) if len(answers) > 1 else (answers[0] if answers else (404, {}))
+        body = b"<timetable/>" if status == 200 else b""
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def stub():
+    """
+    Local API stub. Set stub.answers[path] to a list of (status, headers); each
+    request takes the next answer and the last one repeats. stub.requests records
+    (path, monotonic time) of every request.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.answers = {}
+    server.requests = []
+    server.lock = threading.Lock()
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def client(**kwargs):
+    kwargs.setdefault("backoff", 0.01)
+    kwargs.setdefault("timeout", 5)
+    return ApiClient("application/xml", **kwargs)
+
+def test_retries_429_after_retry_after(stub):
+    stub.answers["/plan"] = [(429, {"Retry-After": "0.3"}), (200, {})]
+    with client() as api:
+        response = api.get(stub.url + "/plan")
+    assert response.status_code == 200
+    assert len(stub.requests) == 2
+    assert stub.requests[1][1] - stub.requests[0][1] >= 0.3
+
+def test_429_pauses_every_caller_of_the_limiter(stub):
+    stub.answers["/plan"] = [(429, {"Retry-After": "0.5"}), (200, {})]
+    stub.answers["/other"] = [(200, {})]
+    with client(requests_per_minute=6000) as api:
+        first = threading.Thread(target=api.get, args=(stub.url + "/plan",))
+        first.start()
+        time.sleep(0.1)
+        api.get(stub.url + "/other")
+        first.join()
+    throttled_at = stub.requests[0][1]
+    other_at = next(at for path, at in stub.requests if path == "/other")
+    assert other_at - throttled_at >= 0.45
+
+def test_retries_server_errors_then_succeeds(stub):
+    stub.answers["/rchg"] = [(503, {"Retry-After": "0"}), (502, {}), (200, {})]
+    with client() as api:
+        assert api.get(stub.url + "/rchg").status_code == 200
+    assert len(stub.requests) == 3
+
+def test_retry_after_beyond_max_backoff_fails_at_once(stub):
+    stub.answers["/fchg"] = [(503, {"Retry-After": "120"})]
+    with client(max_backoff=1) as api:
+        with pytest.raises(requests.exceptions.HTTPError):
+            api.get(stub.url + "/fchg")
+    assert len(stub.requests) == 1
+
+def test_client_errors_are_not_retried(stub):
+    stub.answers["/missing"] = [(404, {})]
+    with client() as api:
+        with pytest.raises(requests.exceptions.HTTPError):
+            api.get(stub.url + "/missing")
+    assert len(stub.requests) == 1
+
+def test_circuit_opens_after_consecutive_failures(stub):
+    stub.answers["/down"] = [(503, {})]
+    with client(max_attempts=5) as api:
+        with pytest.raises(requests.exceptions.HTTPError):
+            api.get(stub.url + "/down", endpoint="down")
+        assert len(stub.requests) == 5
+        with pytest.raises(CircuitOpenError):
+            api.get(stub.url + "/down", endpoint="down")
+        # The open circuit fails fast without sending a request
+        assert len(stub.requests) == 5
+        # Other endpoints have their own circuit
+        stub.answers["/up"] = [(200, {})]
+        assert api.get(stub.url + "/up", endpoint="up").status_code == 200
+
+def test_circuit_lets_one_trial_through_after_reset():
+    breaker = CircuitBreaker(threshold=2, reset_seconds=0.2)
+    breaker.record_failure()
+    breaker.record_failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("plan")
+    time.sleep(0.25)
+    breaker.before_request("plan")
+    # Only one trial request while it is in flight
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request("plan")
+    breaker.record_success()
+    breaker.before_request("plan")
+
+def test_token_bucket_starts_empty_and_paces():
+    bucket = TokenBucket(600)
+    started = time.monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    # 10 per second from an empty bucket: no initial burst
+    assert time.monotonic() - started >= 0.45
+
+def test_token_bucket_saves_up_only_the_burst():
+    bucket = TokenBucket(600, burst=3)
+    time.sleep(0.5)
+    started = time.monotonic()
+    for _ in range(3):
+        bucket.acquire()
+    assert time.monotonic() - started < 0.05
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.08
+
+def test_token_bucket_pause_holds_callers_back():
+    bucket = TokenBucket(6000, burst=5)
+    time.sleep(0.05)
+    bucket.pause(0.3)
+    started = time.monotonic()
+    bucket.acquire()
+    assert time.monotonic() - started >= 0.3
+
+def test_client_paces_requests_to_the_rate(stub):
+    stub.answers["/plan"] = [(200, {})]
+    with client(requests_per_minute=600) as api:
+        for _ in range(4):
+            api.get(stub.url + "/plan")
+    times = [at for _, at in stub.requests]
+    assert all(later - earlier >= 0.08 for earlier, later in zip(times, times[1:]))
+
+def test_retry_after_accepts_seconds_and_dates():
+    response = requests.Response()
+    response.headers["Retry-After"] = "5"
+    assert retry_after(response) == 5.0
+    response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert retry_after(response) == 0.0
+    response.headers["Retry-After"] = "soon"
+    assert retry_after(response) is None
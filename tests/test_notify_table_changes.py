@@ -0,0 +1,86 @@
+"""
+Checks that dbt announces a model on the table_changes channel only when a run
+wrote newer rows. Needs a database set up by `python -m ingestion.setup_db` with
+delayed stops in raw_timetable, DATABASE_URL and the DBT_* variables of
+calculate_delay/profiles.yml, and dbt on the PATH. The test bumps updated_at of
+one raw_timetable row (its values stay the same) and runs dbt on the rollup and
+the marts:
+    python -m pytest tests/test_notify_table_changes.py
+"""
+import os
+import shutil
+import subprocess
+from pathlib import Path
+
+import pytest
+
+psycopg = pytest.importorskip("psycopg")
+
+from ingestion.utils import TABLE_CHANGES_CHANNEL
+
+PROJECT_DIR = Path(__file__).resolve().parent.parent / "calculate_delay"
+MODELS = {
+    "int_delay_rollup",
+    "fct_station_day_hour_summary",
+    "fct_station_delay_summary",
+    "fct_train_category_delay_summary",
+    "fct_train_delay_summary",
+}
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv("DATABASE_URL") or not os.getenv("DBT_HOST") or shutil.which("dbt") is None,
+    reason="needs DATABASE_URL, the DBT_* variables and dbt",
+)
+
+@pytest.fixture
+def listener():
+    with psycopg.connect(os.environ["DATABASE_URL"], autocommit=True) as conn:
+        conn.execute(f"LISTEN {TABLE_CHANGES_CHANNEL};")
+        yield conn
+
+@pytest.fixture
+def dbt_run(tmp_path):
+    def run(*args):
+        subprocess.run(
+            ["dbt", "run", "--project-dir", str(PROJECT_DIR), "--profiles-dir", str(PROJECT_DIR),
+             "--target-path", str(tmp_path / "target"), "--log-path", str(tmp_path / "logs"),
+             "-s", "int_delay_rollup+", *args],
+            check=True, capture_output=True,
+        )
+    return run
+
+def changed_tables(conn):
+    """
+    Tables announced since the last call. A notification is delivered when the
+    sending transaction commits, i.e. before dbt exits.
+    """
+    return {notify.payload for notify in conn.notifies(timeout=0.5)}
+
+def touch_delayed_stop():
+    with psycopg.connect(os.environ["DATABASE_URL"]) as conn:
+        touched = conn.execute("""
+            UPDATE raw_timetable SET updated_at = now()
+            WHERE id = (
+                SELECT id FROM raw_timetable
+                WHERE arrival_delay_seconds IS NOT NULL OR departure_delay_seconds IS NOT NULL
+                LIMIT 1
+            );
+        """).rowcount
+    if not touched:
+        pytest.skip("raw_timetable has no delayed stops")
+
+def test_only_the_run_that_changed_rows_notifies(listener, dbt_run):
+    # Catch up with rows written before the test
+    dbt_run()
+    changed_tables(listener)
+
+    # The lookback re-processes the rows of the first run without announcing them
+    dbt_run()
+    assert changed_tables(listener) == set()
+
+    touch_delayed_stop()
+    dbt_run()
+    assert changed_tables(listener) == MODELS
+
+    dbt_run()
+    assert changed_tables(listener) == set()